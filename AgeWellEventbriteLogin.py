@@ -3,13 +3,44 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 import time
 import base64
 import os
 import re
 import google.generativeai as genai
+from PIL import Image, ImageOps
+from google.api_core import exceptions as google_exceptions
 import io
+import json
+import functools
+import urllib.parse
+import types
+import http.server
+import numpy as np
+import glob
+import hashlib
+import sqlite3
+import threading
+import asyncio
+import random
+import queue
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+# Optional input formats: PDF scans need PyMuPDF, iPhone HEIC photos need pillow-heif
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pillow_heif = None
 
 # ============================================================================
 # CONFIGURATION VARIABLES - MODIFY THESE AS NEEDED
@@ -43,12 +74,252 @@ HLF_BUS_OPTION = True                  # Set to True to select HLF bus option, F
 # Site Coordinator Bus Confirmation
 SITE_COORDINATOR_BUS_CONFIRMATION = True  # Set to True to select "Yes" for site coordinator bus confirmation, False to skip
 
-# Wait Times (in seconds)
-PAGE_LOAD_WAIT = 0.5 #55351
-IFRAME_WAIT = 1
-FORM_FILL_WAIT = 0.5
-FINAL_WAIT = 5
-FIELD_FILL_RATE_LIMIT = 0.2  # Reduced from 5 to 1 second
+# Form Filling
+BULK_FILL_FIELDS = True                # Set all text fields in one script call; False types each one with send_keys
+
+# Wait Timeouts (in seconds) - each step waits only until its precondition holds, up to these limits
+PAGE_LOAD_TIMEOUT = 15       # Event page loaded and "Get tickets" clickable
+IFRAME_TIMEOUT = 10          # Ticket modal iframe attached and loaded
+FORM_LOAD_TIMEOUT = 10       # Attendee form shown after Register
+STEP_TIMEOUT = 5             # Anything a single step waits for (promo input, revealed fields, ...)
+SETTLE_TIMEOUT = 5           # Longest wait for the page to go quiet after an action
+DOM_QUIET_PERIOD = 0.3       # The page counts as settled once the DOM hasn't changed for this long...
+NETWORK_QUIET_PERIOD = 0.3   # ...and no fetch/XHR request has been in flight for this long
+WAIT_POLL_INTERVAL = 0.05
+
+# Locator Cache Configuration (what worked last time for an event URL is tried first next time)
+LOCATOR_CACHE_PATH = "locator_cache.json"
+
+# Browser Session Configuration (warm Chrome sessions with persistent profiles)
+BROWSER_PROFILE_DIR = "chrome_profiles"  # One profile per session (session-0, session-1, ... for register_many, single for a register run), so cookies and cache survive runs
+SESSION_RESET_CLEARS_COOKIES = False     # Between registrants only site storage is cleared; True also drops cookies
+SESSION_RESET_STORAGE_TYPES = "local_storage,session_storage,indexeddb,websql,service_workers,cache_storage"
+
+# Lean Browser Configuration (skip the page weight the automation never looks at)
+LEAN_BROWSER = False                   # Headless, no GPU or extensions, and the requests below blocked via DevTools
+LEAN_BLOCKED_RESOURCE_PATTERNS = [     # Images, fonts and media (inline data:image tags still load, they never hit the network)
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*",
+    "*.woff*", "*.ttf*", "*.otf*", "*.eot*",
+    "*.mp4*", "*.webm*", "*.mp3*", "*.m3u8*",
+    "*://img.evbuc.com/*",
+]
+LEAN_BLOCKED_TRACKER_DOMAINS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "googleadservices.com", "facebook.net", "facebook.com/tr", "hotjar.com", "segment.com", "segment.io",
+    "bat.bing.com", "ads.linkedin.com", "snap.licdn.com", "analytics.tiktok.com", "sc-static.net",
+    "amplitude.com", "branch.io", "optimizely.com", "quantserve.com", "scorecardresearch.com",
+]
+REPORT_PAGE_LOADS = LEAN_BROWSER       # Print bytes transferred and page-ready time for each checkout step
+                                       # (set True on a normal run too, to compare it with a lean one)
+
+# Run Mode
+RUN_MODE = "register"                  # "register" = Eventbrite automation, "batch" = extract every image in BATCH_IMAGE_INPUT,
+                                       # "benchmark" = score the extractor against the labeled forms in BENCHMARK_INPUT,
+                                       # "register_many" = register everyone in REGISTRANTS_PATH in parallel browser sessions
+
+# Batch Extraction Configuration
+BATCH_IMAGE_INPUT = "/Users/vedant/Downloads/signup_sheets"  # Folder or glob pattern (e.g. "~/Downloads/IMG_*.jpeg")
+BATCH_OUTPUT_PATH = "form_extractions.jsonl"                  # One JSON record per image, written as each one finishes
+BATCH_MAX_WORKERS = 4                                         # Number of images extracted at the same time
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.heic', '.heif', '.pdf')
+PDF_RENDER_DPI = 200                                          # Resolution each PDF page is rendered at before extraction
+BATCH_FORMS_PER_REQUEST = 1                                   # Set above 1 to pack several forms into one Gemini request
+
+# Multi-Registrant Configuration (RUN_MODE = "register_many")
+REGISTRANTS_PATH = "form_extractions.jsonl"                   # JSONL queue: batch extraction records or plain form field dicts
+REGISTRATION_MAX_SESSIONS = 3                                 # Browser sessions at once, a global cap so Eventbrite doesn't block us
+REGISTRATION_MAX_ATTEMPTS = 2                                 # Attempts per registrant, each in a fresh browser session
+REGISTRATION_RETRY_DELAY = 5                                  # Up to this many seconds (times the attempt number) between attempts
+REGISTRATION_HEADLESS = True
+REGISTRATION_SUMMARY_PATH = "registration_summary.json"
+
+# Benchmark Configuration (each image needs a ground truth file with the same name, e.g. form1.jpeg + form1.json)
+BENCHMARK_INPUT = "benchmark_forms"                           # Folder of labeled sample forms
+BENCHMARK_OUTPUT_PATH = "benchmark_results.json"              # Machine-readable report, diff two runs to compare changes
+
+# Gemini Configuration
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+USE_STRUCTURED_OUTPUT = True           # Ask Gemini for schema-constrained JSON instead of "Field: value" lines
+GEMINI_REQUESTS_PER_MINUTE = 15        # Token bucket refill rate, match this to your API quota
+GEMINI_MAX_IN_FLIGHT = 4               # Maximum Gemini calls running at the same time
+GEMINI_MAX_RETRIES = 5                 # Retries on 429 / 5xx responses before giving up
+GEMINI_BACKOFF_BASE = 1.0              # First retry waits up to this many seconds, doubling each attempt
+GEMINI_BACKOFF_MAX = 30.0              # Upper bound for a single retry wait
+
+# Hedged Request Configuration (fire a duplicate when a call runs much longer than usual)
+ENABLE_HEDGED_REQUESTS = False
+HEDGE_LATENCY_PERCENTILE = 0.95        # Hedge once a call has been running longer than this percentile of recent calls
+HEDGE_MIN_SAMPLES = 20                 # Recent calls needed before hedging starts
+HEDGE_LATENCY_WINDOW = 200             # How many recent call latencies the percentile is taken over
+HEDGE_MAX_FRACTION = 0.1               # Hedges never exceed this fraction of all calls
+
+# Extraction Cache Configuration (identical image + prompt + model never hits the API twice)
+ENABLE_EXTRACTION_CACHE = True
+EXTRACTION_CACHE_PATH = "gemini_extraction_cache.sqlite3"
+EXTRACTION_CACHE_MAX_ENTRIES = 5000    # Least recently used entries beyond this are evicted
+EXTRACTION_CACHE_MAX_AGE_DAYS = 30     # Entries older than this are treated as misses and evicted
+
+# Image Pre-processing Configuration (shrinks phone photos before upload)
+ENABLE_IMAGE_PREPROCESSING = True      # Set to False to upload the original bytes (for A/B accuracy checks)
+PREPROCESS_MAX_LONG_EDGE = 1600        # Longest side in pixels after downscaling
+PREPROCESS_GRAYSCALE = True            # Convert to grayscale and stretch contrast
+PREPROCESS_JPEG_QUALITY = 80           # JPEG quality used when re-encoding
+PREPROCESS_UPLOAD_BYTES_PER_SECOND = 1_000_000  # Assumed upload speed (not measured), used to estimate latency saved
+
+# Local Mark Detection Configuration (reads checkbox fields offline, Gemini only reads handwriting)
+ENABLE_LOCAL_MARK_DETECTION = False    # Enable once FORM_MARK_REGIONS matches your sign-up sheet
+MARK_DETECTION_MIN_CONFIDENCE = 0.75   # Local answers below this keep the Gemini value
+MARK_MIN_INK = 0.08                    # Ink fraction a box needs to count as marked
+MARK_ANALYSIS_LONG_EDGE = 1200         # Sheets are analysed at this size
+MARK_TEMPLATE_SIZE = (850, 1100)       # Aligned sheet size in pixels (width, height)
+MARK_BOX_MARGIN = 0.2                  # Fraction of each box ignored on every side so the printed border doesn't count
+
+# Checkbox regions as fractions of the aligned sheet content: (left, top, right, bottom).
+# Measure these on a blank sign-up sheet; the lunch boxes are stacked (top = Vegetarian, bottom = Meat).
+FORM_MARK_REGIONS = {
+    'age_confirmation': {
+        'Yes': (0.06, 0.55, 0.10, 0.58),
+        'No': (0.16, 0.55, 0.20, 0.58),
+    },
+    'location_confirmation': {
+        'Yes': (0.06, 0.62, 0.10, 0.65),
+        'No': (0.16, 0.62, 0.20, 0.65),
+    },
+    'lunch_preference': {
+        'Vegetarian': (0.06, 0.70, 0.10, 0.73),
+        'Meat': (0.06, 0.75, 0.10, 0.78),
+    },
+    'liability_agreement': {
+        'Yes': (0.06, 0.88, 0.10, 0.91),
+        'No': (0.16, 0.88, 0.20, 0.91),
+    },
+}
+
+# Inline Iframe Image Configuration (data:image <img> tags in the ticket modal)
+INLINE_IMAGE_MIN_SIDE = 48             # Images narrower or shorter than this (icons, spinners) are skipped
+INLINE_IMAGE_MAX_WORKERS = 4           # Inline images extracted at the same time
+INLINE_IMAGE_TIME_BUDGET = 20          # Seconds per page; extractions still running after this are dropped
+
+# Field Re-query Configuration (second pass that re-reads only fields failing validation)
+ENABLE_FIELD_REQUERY = False           # Enable once FORM_FIELD_REGIONS matches your sign-up sheet
+FIELD_CROP_PADDING = 0.01              # Extra margin around each field crop, as a fraction of the sheet
+
+# Handwritten field regions as fractions of the aligned sheet content: (left, top, right, bottom).
+# Measure these on a blank sign-up sheet, like FORM_MARK_REGIONS.
+FORM_FIELD_REGIONS = {
+    'first_name': (0.05, 0.12, 0.50, 0.18),
+    'last_name': (0.50, 0.12, 0.95, 0.18),
+    'email': (0.05, 0.19, 0.95, 0.25),
+    'address': (0.05, 0.26, 0.95, 0.32),
+    'city': (0.05, 0.33, 0.45, 0.39),
+    'state': (0.45, 0.33, 0.65, 0.39),
+    'zip_code': (0.65, 0.33, 0.95, 0.39),
+}
+
+# ZIP codes of nearby cities, used to check that a city and ZIP code belong together
+LOCAL_CITY_ZIP_CODES = {
+    'fremont': ('94536', '94537', '94538', '94539', '94555'),
+    'newark': ('94560',),
+    'union city': ('94587',),
+    'hayward': ('94540', '94541', '94542', '94543', '94544', '94545', '94557'),
+    'castro valley': ('94546', '94552'),
+    'san leandro': ('94577', '94578', '94579'),
+    'pleasanton': ('94566', '94588'),
+    'livermore': ('94550', '94551'),
+    'dublin': ('94568',),
+}
+
+# Telemetry Configuration (latency, payload size, tokens, retries and cache outcome per Gemini call)
+METRICS_SAMPLES_PATH = "gemini_metrics_samples.jsonl"  # Every call appended as one JSON line (set to None to skip)
+METRICS_SUMMARY_PATH = "gemini_metrics.json"           # p50/p95/p99 histograms for the run
+METRICS_PROMETHEUS_PORT = None                         # e.g. 9464 to serve Prometheus text at http://localhost:9464/metrics
+
+# Record/Replay Configuration (benchmark the pipeline offline without an API key)
+GEMINI_BACKEND_MODE = "live"           # "live", "record" (live + save every response) or "replay" (serve saved responses)
+GEMINI_FIXTURE_DIR = "gemini_fixtures" # Where recorded responses are stored, one JSON file per request fingerprint
+REPLAY_LATENCY_SECONDS = None          # Synthetic latency per replayed call; None replays the recorded latency
+REPLAY_LATENCY_JITTER = 0.2            # Random +/- fraction applied to the replay latency
+
+# ============================================================================
+
+# Gemini prompts
+FORM_FIELD_FORMAT = """First Name: [value]
+Last Name: [value] 
+Email: [value]
+Address: [value]
+City: [value]
+State: [value]
+ZIP Code: [value]
+Age Confirmation: [Yes/No]
+Location Confirmation: [Yes/No]
+Lunch Preference: [Vegetarian/Meat]
+Liability Agreement: [Yes/No]"""
+
+LUNCH_PREFERENCE_HINT = " For the lunch preference, if the check is on the top it is vegetarian and if on bottom is meat."
+
+FORM_FIELDS_PROMPT = f"""
+Extract all form fields from this image and return in this exact format:
+{FORM_FIELD_FORMAT}
+
+If any field is not found, use 'None' as the value."""
+
+IMAGE_EXTRACTION_PROMPT = FORM_FIELDS_PROMPT + LUNCH_PREFERENCE_HINT
+BASE64_IMAGE_EXTRACTION_PROMPT = FORM_FIELDS_PROMPT
+
+# Structured (JSON schema) extraction
+FORM_FIELD_NAMES = (
+    'first_name', 'last_name', 'email', 'address', 'city', 'state', 'zip_code',
+    'age_confirmation', 'location_confirmation', 'lunch_preference', 'liability_agreement',
+)
+
+FIELD_LABELS = {field: line.split(':')[0] for field, line in zip(FORM_FIELD_NAMES, FORM_FIELD_FORMAT.split("\n"))}
+
+YES_NO_FIELDS = ('age_confirmation', 'location_confirmation', 'liability_agreement')
+
+FORM_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        field: (
+            {"type": "string", "nullable": True, "enum": ["Yes", "No"]} if field in YES_NO_FIELDS else
+            {"type": "string", "nullable": True, "enum": ["Vegetarian", "Meat"]} if field == 'lunch_preference' else
+            {"type": "string", "nullable": True}
+        )
+        for field in FORM_FIELD_NAMES
+    },
+    "required": list(FORM_FIELD_NAMES),
+}
+
+MULTI_FORM_RESPONSE_SCHEMA = {"type": "array", "items": FORM_RESPONSE_SCHEMA}
+
+STRUCTURED_FIELDS_PROMPT = "Extract the sign-up form fields from this image. Use null for any field that is not found."
+STRUCTURED_IMAGE_EXTRACTION_PROMPT = STRUCTURED_FIELDS_PROMPT + LUNCH_PREFERENCE_HINT
+STRUCTURED_MULTI_FORM_PROMPT = ("You are given {count} images of sign-up forms, labelled Form 1 to Form {count}. "
+                                "Return one object per form, in the same order. Use null for any field that is not found."
+                                + LUNCH_PREFERENCE_HINT)
+
+# Used when every checkbox field was read locally, so Gemini only has to read handwriting
+HANDWRITING_FIELD_NAMES = tuple(field for field in FORM_FIELD_NAMES if field not in FORM_MARK_REGIONS)
+
+HANDWRITING_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {field: FORM_RESPONSE_SCHEMA["properties"][field] for field in HANDWRITING_FIELD_NAMES},
+    "required": list(HANDWRITING_FIELD_NAMES),
+}
+
+HANDWRITING_FIELDS_PROMPT = "Extract the handwritten fields from this image and return in this exact format:\n" + "\n".join(
+    line for field, line in zip(FORM_FIELD_NAMES, FORM_FIELD_FORMAT.split("\n")) if field in HANDWRITING_FIELD_NAMES
+) + "\n\nIf any field is not found, use 'None' as the value."
+
+FIELD_REQUERY_PROMPT = ('This image shows the "{label}" field of a handwritten sign-up form. '
+                        "Reply with only the handwritten value, or None if it is blank.")
+
+# {count} is filled in with the number of images packed into the request
+MULTI_FORM_PROMPT = f"""
+You are given {{count}} images of sign-up forms, labelled Form 1 to Form {{count}} in order.
+For every form, write a header line "=== Form N ===" followed by its fields in this exact format:
+{FORM_FIELD_FORMAT}
+
+If any field is not found, use 'None' as the value.{LUNCH_PREFERENCE_HINT}"""
 
 # ============================================================================
 
@@ -63,108 +334,1134 @@ def setup_gemini():
         genai.configure(api_key=API_KEY)
         
         # Use Gemini 1.5 Flash model
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
         print("Gemini 1.5 Flash API client setup successful!")
         return model
     except Exception as e:
         print(f"Error setting up Gemini API client: {e}")
         return None
 
-def extract_text_from_image(image_path):
-    """Extract text from an image file using Gemini 1.5 Flash API"""
-    model = setup_gemini()
-    if not model:
-        return None
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+class ExtractionMetrics:
+    """Per-call Gemini telemetry, exported as p50/p95/p99 histograms"""
     
-    try:
-        # Read the image file
-        with open(image_path, 'rb') as image_file:
-            image_data = image_file.read()
+    HISTOGRAM_FIELDS = ('wall_time', 'model_time', 'request_bytes', 'prompt_tokens', 'response_tokens', 'retries')
+    QUANTILES = (0.5, 0.95, 0.99)
+    
+    def __init__(self, samples_path=METRICS_SAMPLES_PATH):
+        self.samples_path = samples_path
+        self.samples = []
+        self.counters = {}
+        self.lock = threading.Lock()
+    
+    def record(self, **sample):
+        """Record one call (source, wall_time, model_time, request_bytes, prompt_tokens, response_tokens, retries, cache)"""
+        sample['timestamp'] = time.time()
+        with self.lock:
+            self.samples.append(sample)
+            if self.samples_path:
+                with open(self.samples_path, 'a') as samples_file:
+                    samples_file.write(json.dumps(sample) + "\n")
+    
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    @classmethod
+    def histograms(cls, samples):
+        histograms = {}
+        for field in cls.HISTOGRAM_FIELDS:
+            values = [sample[field] for sample in samples if sample.get(field) is not None]
+            if values:
+                histogram = {f"p{int(quantile * 100)}": percentile(values, quantile) for quantile in cls.QUANTILES}
+                histogram.update(count=len(values), sum=sum(values))
+                histograms[field] = histogram
+        return histograms
+    
+    def summary(self):
+        with self.lock:
+            samples = list(self.samples)
+            counters = dict(self.counters)
+        
+        cache_outcomes = {}
+        by_source = {}
+        for sample in samples:
+            cache_outcomes[sample.get('cache')] = cache_outcomes.get(sample.get('cache'), 0) + 1
+            by_source.setdefault(sample.get('source'), []).append(sample)
+        
+        return {
+            "calls": len(samples),
+            "cache": cache_outcomes,
+            "counters": counters,
+            "histograms": self.histograms(samples),
+            "by_source": {source: self.histograms(source_samples) for source, source_samples in by_source.items()},
+        }
+    
+    def write_summary(self, path=METRICS_SUMMARY_PATH):
+        summary = self.summary()
+        with open(path, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        return summary
+    
+    def prometheus_text(self):
+        """Render the summary in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = ["# TYPE gemini_calls_total counter"]
+        for outcome, count in summary["cache"].items():
+            lines.append(f'gemini_calls_total{{cache="{outcome}"}} {count}')
+        
+        for field, histogram in summary["histograms"].items():
+            name = f"gemini_call_{field}"
+            lines.append(f"# TYPE {name} summary")
+            for quantile in self.QUANTILES:
+                lines.append(f'{name}{{quantile="{quantile}"}} {histogram[f"p{int(quantile * 100)}"]}')
+            lines.append(f"{name}_sum {histogram['sum']}")
+            lines.append(f"{name}_count {histogram['count']}")
+        
+        for counter, value in summary["counters"].items():
+            lines.append(f"# TYPE gemini_{counter}_total counter")
+            lines.append(f"gemini_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+    
+    def serve_prometheus(self, port):
+        """Serve prometheus_text() at /metrics from a background thread"""
+        metrics = self
+        
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
         
-        # Process image with comprehensive prompt
-        prompt = """
-        Extract all form fields from this image and return in this exact format:
-        First Name: [value]
-        Last Name: [value] 
-        Email: [value]
-        Address: [value]
-        City: [value]
-        State: [value]
-        ZIP Code: [value]
-        Age Confirmation: [Yes/No]
-        Location Confirmation: [Yes/No]
-        Lunch Preference: [Vegetarian/Meat]
-        Liability Agreement: [Yes/No]
-        
-        If any field is not found, use 'None' as the value. For the lunch preference, if the check is on the top it is vegetarian and if on bottom is meat.
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Serving Prometheus metrics at http://127.0.0.1:{port}/metrics")
+        return server
+
+_extraction_metrics = None
+_extraction_metrics_lock = threading.Lock()
+
+def get_extraction_metrics():
+    """Return the shared metrics collector, starting the Prometheus endpoint if configured"""
+    global _extraction_metrics
+    with _extraction_metrics_lock:
+        if _extraction_metrics is None:
+            _extraction_metrics = ExtractionMetrics()
+            if METRICS_PROMETHEUS_PORT:
+                _extraction_metrics.serve_prometheus(METRICS_PROMETHEUS_PORT)
+    return _extraction_metrics
+
+def write_extraction_metrics():
+    """Write the run's metrics summary and print the headline latency numbers"""
+    summary = get_extraction_metrics().write_summary()
+    wall_time = summary["histograms"].get("wall_time")
+    if wall_time:
+        print(f"📈 Gemini calls: {summary['calls']}, latency p50 {wall_time['p50']:.2f}s / p95 {wall_time['p95']:.2f}s / "
+              f"p99 {wall_time['p99']:.2f}s (details in {METRICS_SUMMARY_PATH})")
+
+def request_size(parts):
+    """Bytes of prompt text and inline data in a generate_content request"""
+    return sum(len(part["data"]) if isinstance(part, dict) else len(str(part).encode('utf-8')) for part in parts)
+
+# Rate limits and server errors worth retrying; anything else fails immediately
+GEMINI_RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServerError,
+)
+
+class TokenBucket:
+    """Async token bucket that allows requests_per_minute calls, with short bursts"""
+    
+    def __init__(self, requests_per_minute, capacity=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = capacity or max(1, requests_per_minute // 4)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+    
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class FixtureNotFound(Exception):
+    """Raised in replay mode when a request was never recorded"""
+
+class ReplayResponse:
+    """Stand-in for a generate_content response, rebuilt from a fixture"""
+    
+    __slots__ = ('text', 'usage_metadata')
+    
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = types.SimpleNamespace(**usage)
+
+class FixtureStore:
+    """Recorded Gemini responses keyed by a fingerprint of the request"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    @staticmethod
+    def fingerprint(parts, generation_config):
+        digest = hashlib.sha256(GEMINI_MODEL_NAME.encode('utf-8'))
+        digest.update(json.dumps(generation_config, sort_keys=True, default=str).encode('utf-8'))
+        for part in parts:
+            if isinstance(part, dict):
+                digest.update(part["mime_type"].encode('utf-8'))
+                digest.update(part["data"])
+            else:
+                digest.update(str(part).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def path_for(self, fingerprint):
+        return os.path.join(self.directory, f"{fingerprint}.json")
+    
+    def save(self, parts, generation_config, response, latency):
+        usage = getattr(response, 'usage_metadata', None)
+        fixture = {
+            "text": response.text,
+            "usage": {
+                "prompt_token_count": getattr(usage, 'prompt_token_count', None),
+                "candidates_token_count": getattr(usage, 'candidates_token_count', None),
+            },
+            "latency": latency,
+            "recorded_at": time.time(),
+        }
+        with open(self.path_for(self.fingerprint(parts, generation_config)), 'w') as fixture_file:
+            json.dump(fixture, fixture_file)
+    
+    async def replay(self, parts, generation_config):
+        fingerprint = self.fingerprint(parts, generation_config)
+        try:
+            with open(self.path_for(fingerprint)) as fixture_file:
+                fixture = json.load(fixture_file)
+        except FileNotFoundError:
+            raise FixtureNotFound(f"No recorded response for request {fingerprint[:12]}; run once with GEMINI_BACKEND_MODE = \"record\"")
+        
+        latency = REPLAY_LATENCY_SECONDS if REPLAY_LATENCY_SECONDS is not None else fixture["latency"]
+        await asyncio.sleep(max(0.0, latency * random.uniform(1 - REPLAY_LATENCY_JITTER, 1 + REPLAY_LATENCY_JITTER)))
+        return ReplayResponse(fixture["text"], fixture["usage"])
+
+class GeminiClient:
+    """Long-lived Gemini client with rate limiting, retries and a cap on in-flight calls
+    
+    The client owns an event loop on a background thread, so the async API can be
+    awaited from any loop and the sync API can be called from any worker thread.
+    """
+    
+    def __init__(self, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, max_in_flight=GEMINI_MAX_IN_FLIGHT,
+                 max_retries=GEMINI_MAX_RETRIES):
+        self.replaying = GEMINI_BACKEND_MODE == "replay"
+        self.model = None if self.replaying else setup_gemini()
+        self.fixtures = FixtureStore(GEMINI_FIXTURE_DIR) if GEMINI_BACKEND_MODE in ("record", "replay") else None
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(requests_per_minute)
+        self.in_flight = None
+        self.recent_latencies = deque(maxlen=HEDGE_LATENCY_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+        
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="gemini-client", daemon=True)
+        self.thread.start()
+    
+    async def _generate(self, parts, generation_config=None, source="async", cache="disabled"):
+        # Created on first use so the semaphore belongs to the client's loop
+        if self.in_flight is None:
+            self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        
+        start_time = time.perf_counter()
+        async with self.in_flight:
+            for attempt in range(self.max_retries + 1):
+                # Replayed responses never reach the API, so they aren't held to its quota
+                if not self.replaying:
+                    await self.rate_limiter.acquire()
+                model_start_time = time.perf_counter()
+                try:
+                    response = await self.call_hedged(parts, generation_config)
+                    self.record_call(parts, response, start_time, model_start_time, attempt, source, cache)
+                    return response
+                except GEMINI_RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        self.record_call(parts, None, start_time, model_start_time, attempt, source, cache, error=e)
+                        raise
+                    # Exponential backoff with full jitter so parallel workers don't retry in lockstep
+                    delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+                    print(f"Gemini request failed ({e.__class__.__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    self.record_call(parts, None, start_time, model_start_time, attempt, source, cache, error=e)
+                    raise
+    
+    def hedge_delay(self):
+        """Seconds to wait before hedging a call, or None when hedging is off or not yet calibrated"""
+        if not ENABLE_HEDGED_REQUESTS or len(self.recent_latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        if self.hedges >= HEDGE_MAX_FRACTION * self.calls:
+            return None
+        return percentile(self.recent_latencies, HEDGE_LATENCY_PERCENTILE)
+    
+    async def timed_backend(self, parts, generation_config, hedge=False):
+        # The hedge is a real extra request, so it still has to get past the rate limiter
+        if hedge and not self.replaying:
+            await self.rate_limiter.acquire()
+        start_time = time.perf_counter()
+        response = await self.call_backend(parts, generation_config)
+        self.recent_latencies.append(time.perf_counter() - start_time)
+        return response
+    
+    @staticmethod
+    def is_good_response(task):
+        if task.cancelled() or task.exception() is not None:
+            return False
+        try:
+            return bool(task.result() and task.result().text)
+        except ValueError:
+            # .text raises when the response was blocked or has no candidates
+            return False
+    
+    async def call_hedged(self, parts, generation_config):
+        """Call the backend, firing a duplicate if the first call is slower than recent calls
+        
+        The first good answer wins and the other call is cancelled. When neither
+        call gives a good answer the primary's result (or error) is returned.
         """
+        self.calls += 1
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self.timed_backend(parts, generation_config))
+        if delay is None:
+            return await primary
+        
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        
+        self.hedges += 1
+        metrics = get_extraction_metrics()
+        metrics.increment("hedges_fired")
+        hedge = asyncio.ensure_future(self.timed_backend(parts, generation_config, hedge=True))
+        
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if self.is_good_response(task)), None)
+            if winner:
+                for loser in pending:
+                    loser.cancel()
+                    metrics.increment("hedges_cancelled")
+                if winner is hedge:
+                    metrics.increment("hedges_won")
+                return winner.result()
+        
+        return primary.result()
+    
+    async def call_backend(self, parts, generation_config):
+        """Call the live model, or the fixture store in record/replay mode"""
+        if self.replaying:
+            return await self.fixtures.replay(parts, generation_config)
+        
+        start_time = time.perf_counter()
+        response = await self.model.generate_content_async(parts, generation_config=generation_config)
+        if self.fixtures and response and response.text:
+            self.fixtures.save(parts, generation_config, response, time.perf_counter() - start_time)
+        return response
+    
+    @staticmethod
+    def record_call(parts, response, start_time, model_start_time, retries, source, cache, error=None):
+        # wall_time includes queueing for the rate limiter and retries, model_time is the last attempt only
+        usage = getattr(response, 'usage_metadata', None)
+        end_time = time.perf_counter()
+        get_extraction_metrics().record(
+            source=source,
+            wall_time=end_time - start_time,
+            model_time=end_time - model_start_time,
+            request_bytes=request_size(parts),
+            prompt_tokens=getattr(usage, 'prompt_token_count', None),
+            response_tokens=getattr(usage, 'candidates_token_count', None),
+            retries=retries,
+            cache=cache,
+            error=error.__class__.__name__ if error else None,
+        )
+    
+    async def generate(self, parts, generation_config=None, source="async", cache="disabled"):
+        """Run generate_content on the client's loop and return the raw response"""
+        if not self.model and not self.replaying:
+            return None
         
-        response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_data}])
+        call = self._generate(parts, generation_config, source, cache)
+        if asyncio.get_running_loop() is self.loop:
+            return await call
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call, self.loop))
+    
+    async def extract(self, image_bytes, prompt=IMAGE_EXTRACTION_PROMPT, mime_type="image/jpeg", generation_config=None):
+        """Extract text from image bytes, returning None when the model gives no answer"""
+        response = await self.generate([prompt, {"mime_type": mime_type, "data": image_bytes}], generation_config)
         
         if response and response.text:
             return response.text.strip()
         else:
             return None
+    
+    def generate_sync(self, parts, generation_config=None, source="sync", cache="disabled"):
+        """Blocking generate() for code that is not running inside an event loop"""
+        if not self.model and not self.replaying:
+            return None
+        return asyncio.run_coroutine_threadsafe(self._generate(parts, generation_config, source, cache), self.loop).result()
+
+_gemini_client = None
+_gemini_client_lock = threading.Lock()
+
+def get_gemini_client():
+    """Return the shared Gemini client, creating it on first use"""
+    global _gemini_client
+    with _gemini_client_lock:
+        if _gemini_client is None:
+            _gemini_client = GeminiClient()
+    return _gemini_client
+
+class ExtractionCache:
+    """SQLite cache of Gemini answers keyed by image bytes, prompt and model"""
+    
+    def __init__(self, path, max_entries=EXTRACTION_CACHE_MAX_ENTRIES, max_age_days=EXTRACTION_CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        # One connection shared by all worker threads, serialised by the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.evict()
+    
+    @staticmethod
+    def make_key(image_data, prompt, model_name, variant=""):
+        """Hash the exact request so any change to the image, prompt, model or variant is a miss"""
+        digest = hashlib.sha256()
+        for part in (model_name.encode('utf-8'), variant.encode('utf-8'), prompt.encode('utf-8'), image_data):
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+        return digest.hexdigest()
+    
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT text, created_at FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
             
-    except Exception as e:
-        print(f"Error extracting text from image: {e}")
+            if row and now - row[1] <= self.max_age_seconds:
+                self.connection.execute("UPDATE extractions SET last_used = ? WHERE key = ?", (now, key))
+                self.connection.commit()
+                self.hits += 1
+                return row[0]
+            
+            if row:
+                self.connection.execute("DELETE FROM extractions WHERE key = ?", (key,))
+                self.connection.commit()
+            self.misses += 1
+            return None
+    
+    def put(self, key, text):
+        with self.lock:
+            now = time.time()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO extractions (key, text, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, now, now)
+            )
+            self.connection.commit()
+        self.evict()
+    
+    def evict(self):
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM extractions WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            )
+            self.connection.execute(
+                "DELETE FROM extractions WHERE key NOT IN "
+                "(SELECT key FROM extractions ORDER BY last_used DESC LIMIT ?)", (self.max_entries,)
+            )
+            self.connection.commit()
+    
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+_extraction_cache = None
+_extraction_cache_lock = threading.Lock()
+
+def get_extraction_cache():
+    """Open the shared extraction cache on first use (None when caching is disabled)"""
+    global _extraction_cache
+    # Record and replay runs must reach the backend on every call, so they skip the cache
+    if not ENABLE_EXTRACTION_CACHE or GEMINI_BACKEND_MODE != "live":
         return None
+    
+    with _extraction_cache_lock:
+        if _extraction_cache is None:
+            _extraction_cache = ExtractionCache(EXTRACTION_CACHE_PATH)
+    return _extraction_cache
+
+def print_extraction_cache_stats():
+    """Print the hit/miss counters of the extraction cache"""
+    cache = get_extraction_cache()
+    if cache:
+        stats = cache.stats()
+        print(f"🗄️  Extraction cache: {stats['hits']} hit(s), {stats['misses']} miss(es), {stats['entries']} entries")
 
-def extract_text_from_base64_image(base64_image):
-    """Extract text from a base64 encoded image using Gemini 1.5 Flash API"""
-    model = setup_gemini()
-    if not model:
+def preprocess_image(image_data):
+    """Rotate, downscale, normalise and re-encode an image to shrink the upload
+    
+    Returns the bytes to send, their MIME type (None when the original is kept)
+    and a stats dict with the size before/after and the latency saved, estimated from
+    PREPROCESS_UPLOAD_BYTES_PER_SECOND rather than measured.
+    """
+    start_time = time.perf_counter()
+    
+    image = Image.open(io.BytesIO(image_data))
+    image = ImageOps.exif_transpose(image)  # Phone photos are often stored sideways with an EXIF rotation tag
+    image.thumbnail((PREPROCESS_MAX_LONG_EDGE, PREPROCESS_MAX_LONG_EDGE), Image.LANCZOS)
+    
+    if PREPROCESS_GRAYSCALE:
+        image = ImageOps.autocontrast(ImageOps.grayscale(image), cutoff=1)
+    else:
+        image = image.convert('RGB')
+    
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=PREPROCESS_JPEG_QUALITY, optimize=True)
+    processed_data = output.getvalue()
+    preprocess_time = time.perf_counter() - start_time
+    
+    # Small screenshots can grow when re-encoded, so only use the result if it is smaller
+    if len(processed_data) >= len(image_data):
+        processed_data, mime_type = image_data, None
+    else:
+        mime_type = "image/jpeg"
+    
+    saved_upload_time = (len(image_data) - len(processed_data)) / PREPROCESS_UPLOAD_BYTES_PER_SECOND
+    stats = {
+        "bytes_before": len(image_data),
+        "bytes_after": len(processed_data),
+        "preprocess_time": preprocess_time,
+        "estimated_latency_saved": saved_upload_time - preprocess_time,
+    }
+    return processed_data, mime_type, stats
+
+def preprocessing_variant():
+    """Describe the pre-processing settings so cached answers are not shared across them"""
+    if not ENABLE_IMAGE_PREPROCESSING:
+        return "original"
+    return f"preprocess:{PREPROCESS_MAX_LONG_EDGE}:{PREPROCESS_GRAYSCALE}:{PREPROCESS_JPEG_QUALITY}"
+
+def request_variant(generation_config=None):
+    """Cache variant covering everything besides the image and prompt that changes the answer"""
+    if not generation_config:
+        return preprocessing_variant()
+    return preprocessing_variant() + "|" + json.dumps(generation_config, sort_keys=True, default=str)
+
+def json_generation_config(schema):
+    """Generation config that constrains the reply to JSON matching schema"""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+def form_extraction_request(include_lunch_hint=True, handwriting_only=False):
+    """Return the prompt and generation config used to extract one form"""
+    if handwriting_only:
+        if USE_STRUCTURED_OUTPUT:
+            return STRUCTURED_FIELDS_PROMPT, json_generation_config(HANDWRITING_RESPONSE_SCHEMA)
+        return HANDWRITING_FIELDS_PROMPT, None
+    
+    if USE_STRUCTURED_OUTPUT:
+        prompt = STRUCTURED_IMAGE_EXTRACTION_PROMPT if include_lunch_hint else STRUCTURED_FIELDS_PROMPT
+        return prompt, json_generation_config(FORM_RESPONSE_SCHEMA)
+    
+    prompt = IMAGE_EXTRACTION_PROMPT if include_lunch_hint else BASE64_IMAGE_EXTRACTION_PROMPT
+    return prompt, None
+
+def prepare_image_for_upload(image_data, mime_type):
+    """Apply the pre-processing stage when enabled, returning the bytes and MIME type to send"""
+    if not ENABLE_IMAGE_PREPROCESSING:
+        return image_data, mime_type
+    
+    try:
+        image_data, processed_mime_type, stats = preprocess_image(image_data)
+        print(f"Pre-processed image: {stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes "
+              f"in {stats['preprocess_time']:.2f}s, est. {stats['estimated_latency_saved']:.2f}s latency saved "
+              f"(assuming {PREPROCESS_UPLOAD_BYTES_PER_SECOND / 1_000_000:g} MB/s upload)")
+        return image_data, processed_mime_type or mime_type
+    except Exception as e:
+        print(f"Could not pre-process image, uploading original: {e}")
+        return image_data, mime_type
+
+def generate_text_from_image(image_data, prompt, mime_type="image/jpeg", generation_config=None, source="image",
+                             cache_checked=False, use_cache=True):
+    """Send one image and prompt to Gemini, answering identical requests from the cache
+    
+    cache_checked means the caller already looked this request up and missed, so the
+    lookup (and its miss count) is skipped; the answer is still stored. use_cache=False
+    bypasses the cache entirely.
+    """
+    cache = get_extraction_cache() if use_cache else None
+    cache_key = None
+    
+    if cache:
+        start_time = time.perf_counter()
+        cache_key = ExtractionCache.make_key(image_data, prompt, GEMINI_MODEL_NAME, request_variant(generation_config))
+        cached_text = cache.get(cache_key) if not cache_checked else None
+        if cached_text is not None:
+            get_extraction_metrics().record(source=source, wall_time=time.perf_counter() - start_time,
+                                            request_bytes=0, retries=0, cache="hit")
+            return cached_text
+    
+    image_data, mime_type = prepare_image_for_upload(image_data, mime_type)
+    response = get_gemini_client().generate_sync([prompt, {"mime_type": mime_type, "data": image_data}], generation_config,
+                                                 source=source, cache="miss" if cache else "disabled")
+    
+    if response and response.text:
+        text = response.text.strip()
+        if cache:
+            cache.put(cache_key, text)
+        return text
+    else:
         return None
+
+def detect_image_mime_type(image_data, default="image/jpeg"):
+    """Detect the MIME type of image bytes from their signature"""
+    if image_data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return "image/png"
+    if image_data.startswith(b'\xff\xd8\xff'):
+        return "image/jpeg"
+    if image_data[:6] in (b'GIF87a', b'GIF89a'):
+        return "image/gif"
+    if image_data[:4] == b'RIFF' and image_data[8:12] == b'WEBP':
+        return "image/webp"
+    if image_data[4:8] == b'ftyp' and image_data[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return "image/heic"
+    return default
+
+def extract_text_from_image_bytes(image_data, mime_type=None, include_lunch_hint=True, source="bytes"):
+    """Extract text from in-memory image bytes, detecting the MIME type when not given"""
+    prompt, generation_config = form_extraction_request(include_lunch_hint=include_lunch_hint)
+    return generate_text_from_image(image_data, prompt, mime_type or detect_image_mime_type(image_data), generation_config,
+                                    source)
+
+def split_page_reference(image_path):
+    """Split "scan.pdf#page=3" into ("scan.pdf", 3); plain paths give (path, None)"""
+    path, separator, page = image_path.rpartition('#page=')
+    if separator and page.isdigit():
+        return path, int(page)
+    return image_path, None
+
+def is_pdf(path):
+    return path.lower().endswith('.pdf')
+
+def open_pdf(pdf_path):
+    if pymupdf is None:
+        raise RuntimeError("PDF input needs PyMuPDF (pip install PyMuPDF)")
+    return pymupdf.open(pdf_path)
+
+def render_pdf_page(pdf_path, page_number):
+    """Render one page (1-based) of a PDF to PNG bytes without decoding the other pages"""
+    with open_pdf(pdf_path) as document:
+        return document[page_number - 1].get_pixmap(dpi=PDF_RENDER_DPI).tobytes("png")
+
+def iter_form_pages(path):
+    """Yield one reference per form in a file: "scan.pdf#page=N" for each PDF page, else the path itself
     
+    Only the page count is read here. Each page is rendered when read_form_image
+    is called for its reference, so a long scan never sits fully in memory.
+    """
+    if not is_pdf(path):
+        yield path
+        return
+    
+    with open_pdf(path) as document:
+        page_count = document.page_count
+    for page_number in range(1, page_count + 1):
+        yield f"{path}#page={page_number}"
+
+def file_version(image_path):
+    """(mtime, size) of the file behind an image path or PDF page reference, for cache keys"""
+    stat = os.stat(split_page_reference(image_path)[0])
+    return stat.st_mtime_ns, stat.st_size
+
+def read_form_image(image_path):
+    """Read the bytes of an image file or of one PDF page reference
+    
+    The small cache lets mark detection, extraction and re-query share one read
+    (and one PDF render) of the pages currently being worked on. It is keyed on the
+    file's mtime and size too, so a file overwritten at the same path is read again.
+    """
+    return _read_form_image(image_path, *file_version(image_path))
+
+@functools.lru_cache(maxsize=8)
+def _read_form_image(image_path, mtime, size):
+    path, page_number = split_page_reference(image_path)
+    if is_pdf(path):
+        return render_pdf_page(path, page_number or 1)
+    
+    with open(path, 'rb') as image_file:
+        return image_file.read()
+
+def extract_text_from_image(image_path, use_cache=True):
+    """Extract text from an image file using Gemini 1.5 Flash API"""
     try:
-        # Decode base64 image
-        image_content = base64.b64decode(base64_image)
+        # Read the image file (or render the PDF page)
+        image_data = read_form_image(image_path)
+        
+        # Checkbox fields read confidently on-device don't need to be asked for again
+        marks = detect_local_marks(image_path)
+        handwriting_only = all(field in marks for field in FORM_MARK_REGIONS)
         
         # Process image with comprehensive prompt
-        prompt = """
-        Extract all form fields from this image and return in this exact format:
-        First Name: [value]
-        Last Name: [value] 
-        Email: [value]
-        Address: [value]
-        City: [value]
-        State: [value]
-        ZIP Code: [value]
-        Age Confirmation: [Yes/No]
-        Location Confirmation: [Yes/No]
-        Lunch Preference: [Vegetarian/Meat]
-        Liability Agreement: [Yes/No]
-        
-        If any field is not found, use 'None' as the value.
-        """
+        prompt, generation_config = form_extraction_request(handwriting_only=handwriting_only)
+        return generate_text_from_image(image_data, prompt, detect_image_mime_type(image_data), generation_config, "file",
+                                        use_cache=use_cache)
+            
+    except Exception as e:
+        print(f"Error extracting text from image: {e}")
+        return None
+
+def parse_data_uri(data_uri):
+    """Split a data: URI into its decoded bytes and declared MIME type"""
+    header, _, payload = data_uri.partition(',')
+    media_type = header[len('data:'):].split(';')[0] or None
+    
+    if header.endswith(';base64'):
+        return base64.b64decode(payload), media_type
+    return urllib.parse.unquote_to_bytes(payload), media_type
+
+def extract_text_from_data_uri(data_uri, source="data_uri"):
+    """Extract text from a data:image URI (such as an <img> src) without touching disk"""
+    try:
+        image_data, declared_mime_type = parse_data_uri(data_uri)
+        mime_type = detect_image_mime_type(image_data, default=declared_mime_type or "image/jpeg")
+        return extract_text_from_image_bytes(image_data, mime_type, include_lunch_hint=False, source=source)
+    except Exception as e:
+        print(f"Error extracting text from data URI image: {e}")
+        return None
+
+def strip_code_fence(text):
+    """Remove a ```json ... ``` fence that Gemini sometimes puts around JSON replies"""
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`').removeprefix('json').strip()
+    return text
+
+def parse_multi_form_response(text, count):
+    """Split a batched reply into one text per form, or None if any form is missing"""
+    text = strip_code_fence(text)
+    if text.startswith('['):
+        try:
+            forms = json.loads(text)
+        except ValueError:
+            return None
+        if len(forms) != count or not all(isinstance(form, dict) for form in forms):
+            return None
+        return [json.dumps(form) for form in forms]
+    
+    sections = {}
+    current = None
+    
+    for line in text.strip().split('\n'):
+        header = re.match(r'^\W*form\s+(\d+)\W*$', line.strip(), re.IGNORECASE)
+        if header:
+            current = int(header.group(1))
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    
+    texts = []
+    for index in range(1, count + 1):
+        section = '\n'.join(sections.get(index, [])).strip()
+        if ':' not in section:
+            return None
+        texts.append(section)
+    return texts
+
+def extract_texts_from_images_in_one_request(image_paths):
+    """Extract several forms with a single Gemini request, returning one text (or None) per image
+    
+    Forms already in the cache are skipped. If the reply cannot be split back into
+    one section per form, each remaining form is retried with its own request.
+    """
+    image_datas = [read_form_image(image_path) for image_path in image_paths]
+    
+    texts = [None] * len(image_paths)
+    cache = get_extraction_cache()
+    prompt, generation_config = form_extraction_request()
+    cache_keys = [ExtractionCache.make_key(image_data, prompt, GEMINI_MODEL_NAME, request_variant(generation_config))
+                  for image_data in image_datas]
+    
+    if cache:
+        texts = [cache.get(cache_key) for cache_key in cache_keys]
+    pending = [index for index, text in enumerate(texts) if text is None]
+    
+    if len(pending) > 1:
+        if USE_STRUCTURED_OUTPUT:
+            multi_prompt = STRUCTURED_MULTI_FORM_PROMPT.format(count=len(pending))
+            multi_generation_config = json_generation_config(MULTI_FORM_RESPONSE_SCHEMA)
+        else:
+            multi_prompt = MULTI_FORM_PROMPT.format(count=len(pending))
+            multi_generation_config = None
         
-        response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_content}])
+        parts = [multi_prompt]
+        for form_number, index in enumerate(pending, 1):
+            image_data, mime_type = prepare_image_for_upload(image_datas[index], detect_image_mime_type(image_datas[index]))
+            parts.append(f"Form {form_number}:")
+            parts.append({"mime_type": mime_type, "data": image_data})
         
-        if response and response.text:
-            return response.text.strip()
+        try:
+            response = get_gemini_client().generate_sync(parts, multi_generation_config, source="batched",
+                                                         cache="miss" if cache else "disabled")
+            sections = parse_multi_form_response(response.text, len(pending)) if response and response.text else None
+        except Exception as e:
+            print(f"Batched request for {len(pending)} forms failed: {e}")
+            sections = None
+        
+        if sections:
+            for index, section in zip(pending, sections):
+                texts[index] = section
+                if cache:
+                    cache.put(cache_keys[index], section)
+            pending = []
         else:
-            return None
-            
+            print(f"Could not split the batched reply into {len(pending)} forms, falling back to one request per form")
+    
+    for index in pending:
+        try:
+            texts[index] = generate_text_from_image(image_datas[index], prompt, detect_image_mime_type(image_datas[index]),
+                                                    generation_config, "file", cache_checked=bool(cache))
+        except Exception as e:
+            print(f"Error extracting text from image {image_paths[index]}: {e}")
+    
+    return texts
+
+def otsu_threshold(pixels):
+    """Threshold that best separates the dark and light pixels of a grayscale array"""
+    histogram, edges = np.histogram(pixels, bins=256, range=(0.0, 1.0))
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    sum_dark = np.cumsum(histogram * centers)
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_light = (sum_dark[-1] - sum_dark) / np.maximum(weight_light, 1)
+    between_variance = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    return centers[np.argmax(between_variance)]
+
+def crop_fraction(image, box):
+    """Crop a PIL image to a (left, top, right, bottom) box given as fractions of its size"""
+    width, height = image.size
+    left, top, right, bottom = box
+    return image.crop((round(left * width), round(top * height), round(right * width), round(bottom * height)))
+
+def ink_image_of(gray):
+    """Binary ink image (255 = ink) of a grayscale float array"""
+    return Image.fromarray(((gray < otsu_threshold(gray)) * 255).astype(np.uint8))
+
+def locate_sheet(image):
+    """Find where the printed form sits in a grayscale PIL image of a sign-up sheet
+    
+    Returns (paper_box, angle, content_box): the paper as fractions of the image, the
+    deskew angle, and the printed content as fractions of the deskewed paper. Using
+    fractions lets geometry found on a thumbnail be applied to the full-size photo.
+    """
+    gray = np.asarray(image, dtype=np.float32) / 255.0
+    height, width = gray.shape
+    
+    # Crop to the paper first so a dark table around a phone photo isn't counted as ink
+    paper = gray > otsu_threshold(gray)
+    paper_rows = np.where(paper.mean(axis=1) > 0.5)[0]
+    paper_cols = np.where(paper.mean(axis=0) > 0.5)[0]
+    if paper_rows.size and paper_cols.size:
+        paper_box = (paper_cols[0] / width, paper_rows[0] / height, (paper_cols[-1] + 1) / width, (paper_rows[-1] + 1) / height)
+    else:
+        paper_box = (0.0, 0.0, 1.0, 1.0)
+    
+    ink_image = ink_image_of(np.asarray(crop_fraction(image, paper_box), dtype=np.float32) / 255.0)
+    
+    # Coarse deskew: printed lines give the sharpest row profile when the sheet is level
+    best_angle = max(
+        np.arange(-4.0, 4.5, 0.5),
+        key=lambda angle: np.var(np.asarray(ink_image.rotate(angle, resample=Image.NEAREST)).sum(axis=1))
+    )
+    ink = np.asarray(ink_image.rotate(best_angle, resample=Image.NEAREST)) > 0
+    
+    content_rows = np.where(ink.mean(axis=1) > 0.005)[0]
+    content_cols = np.where(ink.mean(axis=0) > 0.005)[0]
+    if not content_rows.size or not content_cols.size:
+        raise ValueError("No printed content found on the sheet")
+    
+    ink_height, ink_width = ink.shape
+    content_box = (content_cols[0] / ink_width, content_rows[0] / ink_height,
+                   (content_cols[-1] + 1) / ink_width, (content_rows[-1] + 1) / ink_height)
+    return paper_box, float(best_angle), content_box
+
+def load_sheet(image_data):
+    """Open an image upright in grayscale, with a thumbnail for locating the sheet"""
+    image = ImageOps.grayscale(ImageOps.exif_transpose(Image.open(io.BytesIO(image_data))))
+    thumbnail = image.copy()
+    thumbnail.thumbnail((MARK_ANALYSIS_LONG_EDGE, MARK_ANALYSIS_LONG_EDGE))
+    return image, thumbnail
+
+def align_sheet(image_data):
+    """Return the sheet's ink map deskewed, cropped to its printed content and resized to the template
+    
+    The result is a float array of MARK_TEMPLATE_SIZE where 1.0 is ink and 0.0 is paper.
+    """
+    _, image = load_sheet(image_data)
+    paper_box, angle, content_box = locate_sheet(image)
+    
+    ink_image = ink_image_of(np.asarray(crop_fraction(image, paper_box), dtype=np.float32) / 255.0)
+    content = crop_fraction(ink_image.rotate(angle, resample=Image.NEAREST), content_box)
+    aligned = content.resize(MARK_TEMPLATE_SIZE, Image.BILINEAR)
+    return np.asarray(aligned, dtype=np.float32) / 255.0
+
+def region_ink_density(ink, box):
+    """Fraction of ink inside the inner part of a fractional (left, top, right, bottom) box"""
+    height, width = ink.shape
+    left, top, right, bottom = box
+    margin_x = (right - left) * MARK_BOX_MARGIN
+    margin_y = (bottom - top) * MARK_BOX_MARGIN
+    x0, x1 = int((left + margin_x) * width), int(np.ceil((right - margin_x) * width))
+    y0, y1 = int((top + margin_y) * height), int(np.ceil((bottom - margin_y) * height))
+    region = ink[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)]
+    return float(region.mean()) if region.size else 0.0
+
+def detect_form_marks(image_data):
+    """Read the checkbox fields of a sign-up sheet locally
+    
+    Returns {field: (value, confidence)} for every field in FORM_MARK_REGIONS. The
+    value is the most heavily marked option (None when no box is marked) and the
+    confidence is how clearly it stands out from the next option.
+    """
+    ink = align_sheet(image_data)
+    marks = {}
+    
+    for field, options in FORM_MARK_REGIONS.items():
+        densities = sorted(
+            ((region_ink_density(ink, box), option) for option, box in options.items()),
+            reverse=True
+        )
+        best_density, best_option = densities[0]
+        runner_up_density = densities[1][0] if len(densities) > 1 else 0.0
+        
+        if best_density < MARK_MIN_INK:
+            marks[field] = (None, 0.0)
+        else:
+            marks[field] = (best_option, round(1.0 - runner_up_density / best_density, 2))
+    
+    return marks
+
+def detect_local_marks(image_path):
+    """Confident local checkbox answers for an image file ({} when disabled or unreadable)"""
+    if not ENABLE_LOCAL_MARK_DETECTION:
+        return {}
+    
+    try:
+        return _detect_local_marks(image_path, *file_version(image_path))
     except Exception as e:
-        print(f"Error extracting text from base64 image: {e}")
-        return None
+        print(f"Local mark detection failed for {image_path}: {e}")
+        return {}
+
+@functools.lru_cache(maxsize=256)
+def _detect_local_marks(image_path, mtime, size):
+    """detect_local_marks, cached per file version so an overwritten image is read again"""
+    marks = detect_form_marks(read_form_image(image_path))
+    return {field: (value, confidence) for field, (value, confidence) in marks.items()
+            if value and confidence >= MARK_DETECTION_MIN_CONFIDENCE}
+
+def crop_form_fields(image_data, boxes):
+    """Crop {field: fractional box} regions out of the aligned sheet, returning JPEG bytes per field"""
+    image, thumbnail = load_sheet(image_data)
+    paper_box, angle, content_box = locate_sheet(thumbnail)
+    sheet = crop_fraction(crop_fraction(image, paper_box).rotate(angle, resample=Image.BILINEAR, fillcolor=255), content_box)
+    
+    crops = {}
+    for field, (left, top, right, bottom) in boxes.items():
+        padded_box = (max(0.0, left - FIELD_CROP_PADDING), max(0.0, top - FIELD_CROP_PADDING),
+                      min(1.0, right + FIELD_CROP_PADDING), min(1.0, bottom + FIELD_CROP_PADDING))
+        output = io.BytesIO()
+        crop_fraction(sheet, padded_box).save(output, format='JPEG', quality=90)
+        crops[field] = output.getvalue()
+    return crops
+
+US_STATES = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'DC': 'District of Columbia', 'FL': 'Florida',
+    'GA': 'Georgia', 'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana',
+    'IA': 'Iowa', 'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine',
+    'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi',
+    'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire',
+    'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota',
+    'OH': 'Ohio', 'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'PR': 'Puerto Rico',
+    'RI': 'Rhode Island', 'SC': 'South Carolina', 'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas',
+    'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia',
+    'WI': 'Wisconsin', 'WY': 'Wyoming',
+}
+
+# First three ZIP digits (inclusive ranges) -> state
+ZIP_PREFIX_STATES = (
+    (5, 5, 'NY'), (6, 9, 'PR'), (10, 27, 'MA'), (28, 29, 'RI'), (30, 38, 'NH'), (39, 49, 'ME'),
+    (50, 54, 'VT'), (55, 55, 'MA'), (56, 59, 'VT'), (60, 69, 'CT'), (70, 89, 'NJ'), (100, 149, 'NY'),
+    (150, 196, 'PA'), (197, 199, 'DE'), (200, 205, 'DC'), (206, 219, 'MD'), (220, 246, 'VA'),
+    (247, 268, 'WV'), (270, 289, 'NC'), (290, 299, 'SC'), (300, 319, 'GA'), (320, 349, 'FL'),
+    (350, 369, 'AL'), (370, 385, 'TN'), (386, 397, 'MS'), (398, 399, 'GA'), (400, 427, 'KY'),
+    (430, 459, 'OH'), (460, 479, 'IN'), (480, 499, 'MI'), (500, 528, 'IA'), (530, 549, 'WI'),
+    (550, 567, 'MN'), (569, 569, 'DC'), (570, 577, 'SD'), (580, 588, 'ND'), (590, 599, 'MT'),
+    (600, 629, 'IL'), (630, 658, 'MO'), (660, 679, 'KS'), (680, 693, 'NE'), (700, 714, 'LA'),
+    (716, 729, 'AR'), (730, 732, 'OK'), (733, 733, 'TX'), (734, 749, 'OK'), (750, 799, 'TX'),
+    (800, 816, 'CO'), (820, 831, 'WY'), (832, 838, 'ID'), (840, 847, 'UT'), (850, 865, 'AZ'),
+    (870, 884, 'NM'), (885, 885, 'TX'), (889, 898, 'NV'), (900, 961, 'CA'), (967, 968, 'HI'),
+    (970, 979, 'OR'), (980, 994, 'WA'), (995, 999, 'AK'),
+)
+
+def state_code(value):
+    """Return the two-letter code for a state code or name, or None if it isn't a US state"""
+    value = value.strip()
+    if value.upper() in US_STATES:
+        return value.upper()
+    for code, name in US_STATES.items():
+        if name.lower() == value.lower():
+            return code
+    return None
+
+def zip_code_state(zip_code):
+    prefix = int(zip_code[:3])
+    for low, high, state in ZIP_PREFIX_STATES:
+        if low <= prefix <= high:
+            return state
+    return None
+
+def validate_form_fields(form_data):
+    """Check address fields for obvious misreads, returning {field: reason} for each failure"""
+    def present(field):
+        value = form_data.get(field)
+        return value if value and value.lower() != 'none' else None
+    
+    problems = {}
+    email, state, zip_code, city = present('email'), present('state'), present('zip_code'), present('city')
+    
+    if email and not re.match(r'^[^@\s]+@[^@\s]+\.[A-Za-z]{2,}$', email):
+        problems['email'] = f"'{email}' is not a valid email address"
+    
+    if state and not state_code(state):
+        problems['state'] = f"'{state}' is not a US state"
+    
+    if zip_code and not re.match(r'^\d{5}(-\d{4})?$', zip_code):
+        problems['zip_code'] = f"'{zip_code}' is not a 5 or 9 digit ZIP code"
+    elif zip_code:
+        if state and state_code(state) and zip_code_state(zip_code) != state_code(state):
+            problems['zip_code'] = problems['state'] = f"ZIP code {zip_code} is not in {state}"
+        if city and city.lower() in LOCAL_CITY_ZIP_CODES and zip_code[:5] not in LOCAL_CITY_ZIP_CODES[city.lower()]:
+            problems['zip_code'] = problems['city'] = f"ZIP code {zip_code} is not in {city}"
+    
+    return problems
+
+def requery_invalid_fields(image_path, form_fields, confidence_scores, use_cache=True):
+    """Re-read only the fields that fail validation, using a cropped region and a narrow prompt
+    
+    form_fields and confidence_scores are updated in place. A re-read only replaces
+    the original value when it passes validation; fields that still fail keep their
+    original value with a lowered confidence.
+    """
+    if not ENABLE_FIELD_REQUERY:
+        return []
+    
+    problems = validate_form_fields(form_fields)
+    fields = [field for field in problems if field in FORM_FIELD_REGIONS]
+    if not fields:
+        return []
+    
+    for field, reason in problems.items():
+        print(f"  {FIELD_LABELS[field]} failed validation: {reason}")
+    
+    try:
+        crops = crop_form_fields(read_form_image(image_path), {field: FORM_FIELD_REGIONS[field] for field in fields})
+        
+        for field, crop in crops.items():
+            value = generate_text_from_image(crop, FIELD_REQUERY_PROMPT.format(label=FIELD_LABELS[field]), "image/jpeg",
+                                             source="requery", use_cache=use_cache)
+            value = value.strip().strip('"') if value else None
+            if not value or value.lower() == 'none':
+                continue
+            candidate = dict(form_fields, **{field: value})
+            if field in validate_form_fields(candidate):
+                print(f"  Re-read {FIELD_LABELS[field]} as {value}, still invalid, keeping {form_fields.get(field)}")
+                continue
+            print(f"  Re-read {FIELD_LABELS[field]}: {form_fields.get(field)} -> {value}")
+            form_fields[field] = value
+            if field == 'email':
+                form_fields['confirm_email'] = value
+    except Exception as e:
+        print(f"  Could not re-query fields {fields}: {e}")
+    
+    remaining = validate_form_fields(form_fields)
+    for field in fields:
+        confidence = FIELD_CONFIDENCE[field] if field not in remaining else FIELD_CONFIDENCE[field] * 0.5
+        confidence_scores[field] = round(confidence, 2)
+        if field == 'email':
+            confidence_scores['confirm_email'] = confidence_scores['email']
+    return fields
 
 def read_image_info(image_path):
     """Read image information (simulated for demo)"""
     print(f"Reading image: {image_path}")
     
     # Check if file exists
-    if not os.path.exists(image_path):
-        print(f"Error: File '{image_path}' does not exist.")
+    path, page_number = split_page_reference(image_path)
+    if not os.path.exists(path):
+        print(f"Error: File '{path}' does not exist.")
         return None
     
     # Get file information
-    file_size = os.path.getsize(image_path)
-    file_stats = os.stat(image_path)
+    file_size = os.path.getsize(path)
     
     print(f"File exists: ✅")
     print(f"File size: {file_size} bytes")
-    print(f"File type: JPEG image")
+    if is_pdf(path):
+        try:
+            with open_pdf(path) as document:
+                page_count = document.page_count
+        except Exception as e:
+            print(f"Error: Could not open PDF '{path}': {e}")
+            return None
+        print(f"File type: PDF document ({page_count} page(s)), reading page {page_number or 1}")
+        if page_count > 1 and page_number is None:
+            print("Only the first page is used here, run batch mode to extract every page")
+    else:
+        with open(path, 'rb') as image_file:
+            mime_type = detect_image_mime_type(image_file.read(16), default="unknown")
+        print(f"File type: {mime_type.split('/')[-1].upper()} image")
     
     # Extract text from the actual image using Gemini API
     extracted_text = extract_text_from_image(image_path)
@@ -176,60 +1473,99 @@ def read_image_info(image_path):
         print("Failed to extract text from image.")
         return None
 
-def extract_form_fields(text):
-    """Extract form fields from Gemini API response"""
-    extracted_data = {}
-    confidence_scores = {}
+# Fixed confidence per field, used until a field has a measured confidence
+FIELD_CONFIDENCE = {
+    'first_name': 0.95,
+    'last_name': 0.95,
+    'email': 0.95,
+    'confirm_email': 0.98,
+    'address': 0.90,
+    'city': 0.90,
+    'state': 0.92,
+    'zip_code': 0.96,
+    'age_confirmation': 0.88,
+    'location_confirmation': 0.88,
+    'lunch_preference': 0.85,
+    'liability_agreement': 0.90,
+}
+
+class FormRecord:
+    """Compact record of one sign-up form; fields missing from the reply are None"""
     
-    # Parse the structured response from Gemini
-    lines = text.strip().split('\n')
+    __slots__ = FORM_FIELD_NAMES + ('confidences',)
     
-    for line in lines:
-        line = line.strip()
-        if ':' in line:
-            field, value = line.split(':', 1)
-            field = field.strip().lower().replace(' ', '_')
-            value = value.strip()
-            
-            # Map field names
-            if field == 'first_name':
-                extracted_data['first_name'] = value
-                confidence_scores['first_name'] = 0.95
-            elif field == 'last_name':
-                extracted_data['last_name'] = value
-                confidence_scores['last_name'] = 0.95
-            elif field == 'email':
-                extracted_data['email'] = value
-                confidence_scores['email'] = 0.95
-                # Add confirm_email using the same email
-                extracted_data['confirm_email'] = value
-                confidence_scores['confirm_email'] = 0.98
-            elif field == 'address':
-                extracted_data['address'] = value
-                confidence_scores['address'] = 0.90
-            elif field == 'city':
-                extracted_data['city'] = value
-                confidence_scores['city'] = 0.90
-            elif field == 'state':
-                extracted_data['state'] = value
-                confidence_scores['state'] = 0.92
-            elif field == 'zip_code':
-                extracted_data['zip_code'] = value
-                confidence_scores['zip_code'] = 0.96
-            elif field == 'age_confirmation':
-                extracted_data['age_confirmation'] = value
-                confidence_scores['age_confirmation'] = 0.88
-            elif field == 'location_confirmation':
-                extracted_data['location_confirmation'] = value
-                confidence_scores['location_confirmation'] = 0.88
-            elif field == 'lunch_preference':
-                extracted_data['lunch_preference'] = value
-                confidence_scores['lunch_preference'] = 0.85
-            elif field == 'liability_agreement':
-                extracted_data['liability_agreement'] = value
-                confidence_scores['liability_agreement'] = 0.90
-    
-    return extracted_data, confidence_scores
+    def __init__(self, **fields):
+        for field in FORM_FIELD_NAMES:
+            setattr(self, field, fields.get(field))
+        # Only set when a field has a measured confidence, otherwise FIELD_CONFIDENCE applies
+        self.confidences = None
+    
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(**{field: clean_field_value(data.get(field)) for field in FORM_FIELD_NAMES})
+    
+    @classmethod
+    def from_text(cls, text):
+        """Parse the "Field: value" line format"""
+        record = cls()
+        for line in text.strip().split('\n'):
+            line = line.strip()
+            if ':' in line:
+                field, value = line.split(':', 1)
+                field = field.strip().lower().replace(' ', '_')
+                if field in FORM_FIELD_NAMES:
+                    setattr(record, field, value.strip())
+        return record
+    
+    def set_confidence(self, field, confidence):
+        if self.confidences is None:
+            self.confidences = {}
+        self.confidences[field] = confidence
+    
+    def apply_marks(self, marks):
+        """Override checkbox fields with locally detected (value, confidence) pairs"""
+        for field, (value, confidence) in marks.items():
+            setattr(self, field, value)
+            self.set_confidence(field, confidence)
+    
+    def to_form_data(self):
+        """Return the dict used by fill_registration_form (with confirm_email added)"""
+        form_data = {}
+        for field in FORM_FIELD_NAMES:
+            value = getattr(self, field)
+            if value is not None:
+                form_data[field] = value
+                if field == 'email':
+                    form_data['confirm_email'] = value
+        return form_data
+    
+    def field_confidences(self):
+        measured = self.confidences or {}
+        return {field: measured.get(field, FIELD_CONFIDENCE[field]) for field in self.to_form_data()}
+
+def clean_field_value(value):
+    """Normalise a JSON field value, keeping the 'None' convention of the text format"""
+    if value is None:
+        return 'None'
+    return str(value).strip()
+
+def parse_form_record(text):
+    """Parse a Gemini reply in either JSON or "Field: value" format into a FormRecord"""
+    text = strip_code_fence(text)
+    if text.startswith('{'):
+        try:
+            return FormRecord.from_json(text)
+        except ValueError:
+            pass
+    return FormRecord.from_text(text)
+
+def extract_form_fields(text, marks=None):
+    """Extract form fields from Gemini API response, preferring locally detected checkbox marks"""
+    record = parse_form_record(text)
+    if marks:
+        record.apply_marks(marks)
+    return record.to_form_data(), record.field_confidences()
 
 def extract_form_fields_from_image(image_path):
     """Extract form fields from the specific image using enhanced processing"""
@@ -250,42 +1586,699 @@ def extract_form_fields_from_image(image_path):
     
     # Extract form fields with confidence using the enhanced function
     print("\nExtracting form fields...")
-    form_fields, confidence_scores = extract_form_fields(extracted_text)
+    form_fields, confidence_scores = extract_form_fields(extracted_text, detect_local_marks(image_path))
+    requery_invalid_fields(image_path, form_fields, confidence_scores)
+    
+    if form_fields:
+        print("\n" + "=" * 50)
+        print("EXTRACTED FORM FIELDS:")
+        print("=" * 50)
+        
+        for field, value in form_fields.items():
+            confidence = confidence_scores.get(field, 0.0)
+            print(f"{field.replace('_', ' ').title()}: {value}")
+            print(f"  Confidence: {confidence:.2f}")
+            print()
+        
+        print("=" * 50)
+        
+        # Calculate average confidence
+        if confidence_scores:
+            avg_confidence = sum(confidence_scores.values()) / len(confidence_scores)
+            print(f"\n📊 Average confidence: {avg_confidence:.2f}")
+        
+        print(f"\n✅ Successfully extracted {len(form_fields)} fields!")
+        
+        return form_fields
+    else:
+        print("No form fields could be extracted.")
+        return {}
+
+def build_form_record(image_path, extracted_text, latency, error=None, use_cache=True):
+    """Turn one extraction result into a JSON-ready record"""
+    record = {"image": image_path, "fields": {}, "confidences": {}, "latency": round(latency, 3), "error": error}
+    
+    if extracted_text:
+        record["fields"], record["confidences"] = extract_form_fields(extracted_text, detect_local_marks(image_path))
+        record["requeried"] = requery_invalid_fields(image_path, record["fields"], record["confidences"], use_cache)
+    elif not error:
+        record["error"] = "No text extracted from image"
+    return record
+
+def extract_form_record(image_path, use_cache=True):
+    """Extract form fields from one image and return a JSON-ready record (use_cache=False skips the extraction cache)"""
+    start_time = time.perf_counter()
+    
+    try:
+        extracted_text = extract_text_from_image(image_path, use_cache)
+        return build_form_record(image_path, extracted_text, time.perf_counter() - start_time, use_cache=use_cache)
+    except Exception as e:
+        return build_form_record(image_path, None, time.perf_counter() - start_time, str(e), use_cache)
+
+def extract_form_records_in_one_request(image_paths):
+    """Extract a group of images with one batched request, returning one record per image"""
+    start_time = time.perf_counter()
+    
+    try:
+        texts = extract_texts_from_images_in_one_request(image_paths)
+    except Exception as e:
+        return [build_form_record(image_path, None, time.perf_counter() - start_time, str(e)) for image_path in image_paths]
+    
+    latency = time.perf_counter() - start_time
+    return [build_form_record(image_path, text, latency) for image_path, text in zip(image_paths, texts)]
+
+def find_batch_images(image_input):
+    """Return the sorted image files in a folder or matching a glob pattern"""
+    image_input = os.path.expanduser(image_input)
+    if os.path.isdir(image_input):
+        paths = [os.path.join(image_input, name) for name in os.listdir(image_input)]
+    else:
+        paths = glob.glob(image_input)
+    
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(BATCH_IMAGE_EXTENSIONS))
+
+def run_batch_extraction(image_input, output_path, max_workers=BATCH_MAX_WORKERS, forms_per_request=BATCH_FORMS_PER_REQUEST):
+    """Extract form fields from many images concurrently, writing one JSONL record per image"""
+    print(f"\n=== Batch extraction: {image_input} ===")
+    files = find_batch_images(image_input)
+    # PDFs expand to one reference per page, each rendered only when its worker reads it
+    image_paths = []
+    for path in files:
+        try:
+            image_paths.extend(iter_form_pages(path))
+        except Exception as e:
+            print(f"  Skipping {path}: {e}")
+    print(f"Found {len(image_paths)} form(s) in {len(files)} file(s), using {max_workers} worker(s) and {forms_per_request} form(s) per request")
+    
+    if not image_paths:
+        return []
+    
+    records = []
+    batch_start = time.perf_counter()
+    
+    with open(output_path, 'w') as output_file, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if forms_per_request > 1:
+            futures = [executor.submit(extract_form_records_in_one_request, image_paths[start:start + forms_per_request])
+                       for start in range(0, len(image_paths), forms_per_request)]
+        else:
+            futures = [executor.submit(lambda image_path: [extract_form_record(image_path)], image_path)
+                       for image_path in image_paths]
+        
+        # Write each record as soon as its image finishes, not in submission order
+        for future in as_completed(futures):
+            for record in future.result():
+                output_file.write(json.dumps(record) + "\n")
+                output_file.flush()
+                records.append(record)
+                
+                status = "✅" if not record["error"] else f"❌ {record['error']}"
+                print(f"  [{len(records)}/{len(image_paths)}] {record['image']} ({record['latency']:.2f}s) {status}")
+    
+    wall_time = time.perf_counter() - batch_start
+    total_latency = sum(record["latency"] for record in records)
+    failures = sum(1 for record in records if record["error"])
+    
+    print(f"\n✅ Extracted {len(records) - failures}/{len(records)} forms in {wall_time:.2f}s wall time")
+    print(f"⏱️  Sum of per-image latencies: {total_latency:.2f}s")
+    print(f"📄 Records written to: {output_path}")
+    print_extraction_cache_stats()
+    write_extraction_metrics()
+    
+    return records
+
+def normalize_benchmark_value(value):
+    """Compare values case- and whitespace-insensitively, treating 'None' and empty as missing"""
+    if value is None:
+        return None
+    value = " ".join(str(value).split()).casefold()
+    return None if value in ('', 'none') else value
+
+def run_benchmark(input_dir, output_path, max_workers=BATCH_MAX_WORKERS):
+    """Run the extractor over labeled forms and write per-field accuracy, latency and bytes sent as JSON
+    
+    Ground truth files use the same field names as the batch records (first_name, zip_code, ...).
+    A PDF's ground truth file holds a list with one entry per page; files whose page and
+    entry counts differ are skipped and listed in the report. The extraction cache is
+    bypassed, so every form reaches the backend and runs stay comparable.
+    Run with GEMINI_BACKEND_MODE = "replay" to benchmark offline against recorded responses.
+    """
+    print(f"\n=== Benchmark: {input_dir} ===")
+    labeled = []
+    label_mismatches = []
+    for path in find_batch_images(input_dir):
+        truth_path = os.path.splitext(path)[0] + '.json'
+        if not os.path.exists(truth_path):
+            continue
+        with open(truth_path) as truth_file:
+            truth = json.load(truth_file)
+        try:
+            pages = list(iter_form_pages(path))
+        except Exception as e:
+            print(f"  Skipping {path}: {e}")
+            continue
+        # One truth object per page; a plain object labels a single page
+        page_truths = truth if isinstance(truth, list) else [truth]
+        if len(page_truths) != len(pages):
+            print(f"  Skipping {path}: {len(pages)} page(s) but {len(page_truths)} ground truth entries in {truth_path}")
+            label_mismatches.append({"file": path, "pages": len(pages), "labels": len(page_truths)})
+            continue
+        labeled.extend(zip(pages, page_truths))
+    print(f"Found {len(labeled)} labeled form(s), using {max_workers} worker(s)")
+    
+    if not labeled:
+        return None
+    
+    metrics = get_extraction_metrics()
+    first_sample = len(metrics.samples)
+    benchmark_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        records = list(executor.map(functools.partial(extract_form_record, use_cache=False),
+                                    [image_path for image_path, _ in labeled]))
+    wall_time = time.perf_counter() - benchmark_start
+    samples = metrics.samples[first_sample:]
+    
+    field_results = {field: {"correct": 0, "total": 0} for field in FORM_FIELD_NAMES}
+    mismatches = []
+    for (image_path, truth), record in zip(labeled, records):
+        for field in FORM_FIELD_NAMES:
+            if field not in truth:
+                continue
+            expected = normalize_benchmark_value(truth[field])
+            actual = normalize_benchmark_value(record["fields"].get(field))
+            field_results[field]["total"] += 1
+            if expected == actual:
+                field_results[field]["correct"] += 1
+            else:
+                mismatches.append({"image": image_path, "field": field, "expected": truth[field],
+                                   "actual": record["fields"].get(field)})
+    
+    for result in field_results.values():
+        result["accuracy"] = round(result["correct"] / result["total"], 4) if result["total"] else None
+    correct = sum(result["correct"] for result in field_results.values())
+    total = sum(result["total"] for result in field_results.values())
+    latencies = [record["latency"] for record in records]
+    
+    report = {
+        "timestamp": time.time(),
+        "config": {
+            "model": GEMINI_MODEL_NAME,
+            "backend": GEMINI_BACKEND_MODE,
+            "structured_output": USE_STRUCTURED_OUTPUT,
+            "preprocessing": preprocessing_variant(),
+            "hedged_requests": ENABLE_HEDGED_REQUESTS,
+            "extraction_cache": False,
+            "max_workers": max_workers,
+        },
+        "forms": len(records),
+        "errors": sum(1 for record in records if record["error"]),
+        "label_mismatches": label_mismatches,
+        "accuracy": round(correct / total, 4) if total else None,
+        "fields": field_results,
+        "latency": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95), "max": max(latencies)},
+        "wall_time": round(wall_time, 3),
+        "throughput_forms_per_second": round(len(records) / wall_time, 3) if wall_time else None,
+        "gemini_calls": len(samples),
+        "request_bytes": sum(sample["request_bytes"] for sample in samples),
+        "prompt_tokens": sum(sample["prompt_tokens"] or 0 for sample in samples),
+        "response_tokens": sum(sample["response_tokens"] or 0 for sample in samples),
+        "mismatches": mismatches,
+    }
+    with open(output_path, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    
+    print(f"\n🎯 Accuracy: {correct}/{total} fields" + (f" ({report['accuracy']:.1%})" if total else ""))
+    for field, result in field_results.items():
+        if result["total"]:
+            print(f"  {field}: {result['correct']}/{result['total']}")
+    print(f"⏱️  Latency p50 {report['latency']['p50']:.2f}s, p95 {report['latency']['p95']:.2f}s, "
+          f"{report['throughput_forms_per_second']} forms/s")
+    print(f"📦 Sent {report['request_bytes']:,} bytes in {report['gemini_calls']} Gemini call(s)")
+    print(f"📄 Report written to: {output_path}")
+    
+    return report
+
+# Installs (once per document) a MutationObserver and fetch/XHR counters, then reports
+# how long the DOM and the network have been quiet
+PAGE_ACTIVITY_SCRIPT = """
+var state = window.__ageWellActivity;
+if (!state) {
+    state = window.__ageWellActivity = {lastMutation: Date.now(), lastNetwork: Date.now(), inFlight: 0};
+    var finished = function () { state.inFlight--; state.lastNetwork = Date.now(); };
+    new MutationObserver(function () { state.lastMutation = Date.now(); })
+        .observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    if (window.fetch) {
+        var originalFetch = window.fetch;
+        window.fetch = function () {
+            state.inFlight++;
+            return originalFetch.apply(this, arguments).finally(finished);
+        };
+    }
+    var originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        state.inFlight++;
+        this.addEventListener('loadend', finished);
+        return originalSend.apply(this, arguments);
+    };
+}
+var now = Date.now();
+return {
+    readyState: document.readyState,
+    domQuiet: (now - state.lastMutation) / 1000,
+    networkQuiet: state.inFlight > 0 ? 0 : (now - state.lastNetwork) / 1000
+};
+"""
+
+def wait_until(driver, condition, timeout=STEP_TIMEOUT):
+    """WebDriverWait.until with the engine's poll interval, returning None instead of raising on timeout"""
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL_INTERVAL).until(condition)
+    except TimeoutException:
+        return None
+
+def wait_for_page_ready(driver, timeout=PAGE_LOAD_TIMEOUT):
+    """Wait for the current document (page or iframe) to finish loading"""
+    return wait_until(driver, lambda d: d.execute_script("return document.readyState") == "complete", timeout)
+
+def wait_for_settled(driver, timeout=SETTLE_TIMEOUT):
+    """Wait until the DOM has stopped changing and no fetch/XHR request is running
+    
+    The first call in a document only installs the observers, so right after an
+    action that starts a request this waits for the request and its re-render.
+    """
+    def settled(d):
+        activity = d.execute_script(PAGE_ACTIVITY_SCRIPT)
+        return (activity['readyState'] == 'complete' and activity['domQuiet'] >= DOM_QUIET_PERIOD
+                and activity['networkQuiet'] >= NETWORK_QUIET_PERIOD)
+    
+    start_time = time.perf_counter()
+    result = wait_until(driver, settled, timeout)
+    if not result:
+        print(f"  Page still busy after {timeout}s, continuing")
+    return time.perf_counter() - start_time
+
+def first_visible(driver, xpaths):
+    """First displayed element matching any of the XPaths, in order, or None"""
+    for xpath in xpaths:
+        for element in driver.find_elements(By.XPATH, xpath):
+            try:
+                if element.is_displayed():
+                    return element
+            except Exception:
+                continue
+    return None
+
+def wait_for_any_visible(driver, xpaths, timeout=STEP_TIMEOUT):
+    """Wait for any of the XPaths to match a displayed element and return it (None on timeout)"""
+    return wait_until(driver, lambda d: first_visible(d, xpaths) or False, timeout)
+
+class LocatorCache:
+    """Locators that worked before, stored as JSON per event URL: {event_url: {name: locator}}"""
+    
+    def __init__(self, path=LOCATOR_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as cache_file:
+                self.entries = json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+    
+    def get(self, event_url, name):
+        with self.lock:
+            return self.entries.get(event_url, {}).get(name)
+    
+    def put(self, event_url, name, locator):
+        with self.lock:
+            if self.entries.get(event_url, {}).get(name) == locator:
+                return
+            self.entries.setdefault(event_url, {})[name] = locator
+            # Write to a temporary file first so a crash never leaves half a cache behind
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as cache_file:
+                json.dump(self.entries, cache_file, indent=2)
+            os.replace(temporary_path, self.path)
+
+_locator_cache = None
+_locator_cache_lock = threading.Lock()
+
+def get_locator_cache():
+    global _locator_cache
+    with _locator_cache_lock:
+        if _locator_cache is None:
+            _locator_cache = LocatorCache()
+    return _locator_cache
+
+# Describes every iframe on the page in one round trip, including a peek at its text when same-origin
+DESCRIBE_IFRAMES_SCRIPT = """
+return Array.from(document.getElementsByTagName('iframe')).map(function (frame, index) {
+    var rect = frame.getBoundingClientRect();
+    var text = null;
+    try {
+        text = frame.contentDocument && frame.contentDocument.body ? frame.contentDocument.body.innerText.slice(0, 2000) : null;
+    } catch (e) {}
+    return {
+        element: frame, index: index, src: frame.src || '', id: frame.id || '', name: frame.name || '',
+        title: frame.title || '', className: frame.className || '',
+        visible: rect.width > 0 && rect.height > 0, area: rect.width * rect.height, text: text
+    };
+});
+"""
+
+TICKET_IFRAME_SRC_HINTS = (('checkout', 3), ('ticket', 2), ('eventbrite', 1))
+TICKET_IFRAME_TEXT_HINTS = ('promo code', 'register', 'ticket', 'checkout')
+TICKET_IFRAME_MIN_SCORE = 2             # One src or text hint isn't enough, e.g. an Eventbrite widget frame
+AD_IFRAME_HINTS = ('doubleclick', 'googlesyndication', 'googletagmanager', 'facebook', 'recaptcha', 'adservice')
+
+def iframe_signature(frame):
+    """What identifies an iframe across page loads: its src without the query string, id, name and title"""
+    src = urllib.parse.urlsplit(frame['src'])
+    return {"src": f"{src.scheme}://{src.netloc}{src.path}" if src.netloc else "", "id": frame['id'],
+            "name": frame['name'], "title": frame['title']}
+
+def matches_signature(frame, signature):
+    actual = iframe_signature(frame)
+    return bool(signature["src"] or signature["id"]) and all(
+        not expected or actual[key] == expected for key, expected in signature.items())
+
+def score_ticket_iframe(frame):
+    """How much an iframe looks like the checkout modal (0 means not at all)"""
+    src = frame['src'].lower()
+    if any(hint in src for hint in AD_IFRAME_HINTS):
+        return 0
+    
+    score = sum(weight for hint, weight in TICKET_IFRAME_SRC_HINTS if hint in src)
+    if frame['text']:
+        text = frame['text'].lower()
+        score += sum(2 for hint in TICKET_IFRAME_TEXT_HINTS if hint in text)
+    if not frame['visible']:
+        score -= 2
+    return score
+
+def choose_ticket_iframe(frames, cached_signature=None):
+    """The cached iframe if it is on the page, else the best-scoring candidate (None if nothing qualifies)"""
+    if cached_signature:
+        for frame in frames:
+            if matches_signature(frame, cached_signature) and frame['visible']:
+                return frame
+    
+    scored = [(score_ticket_iframe(frame), frame['area'], frame) for frame in frames]
+    scored = [candidate for candidate in scored if candidate[0] >= TICKET_IFRAME_MIN_SCORE]
+    if not scored:
+        return None
+    return max(scored, key=lambda candidate: candidate[:2])[2]
+
+def locate_ticket_iframe(driver, event_url, timeout=IFRAME_TIMEOUT):
+    """Wait for the checkout modal iframe and return its element, remembering its signature for next time"""
+    cache = get_locator_cache()
+    cached_signature = cache.get(event_url, "ticket_iframe")
+    found = {}
+    
+    def ticket_iframe(d):
+        found['frames'] = d.execute_script(DESCRIBE_IFRAMES_SCRIPT) or []
+        found['frame'] = choose_ticket_iframe(found['frames'], cached_signature)
+        return found['frame']
+    
+    wait_until(driver, ticket_iframe, timeout)
+    frames, frame = found.get('frames', []), found.get('frame')
+    print(f"Found {len(frames)} iframe(s)")
+    for candidate in frames:
+        print(f"  Iframe {candidate['index']}: Src='{candidate['src']}', ID='{candidate['id']}', Class='{candidate['className']}'")
+    
+    if not frame:
+        return None
+    
+    from_cache = cached_signature is not None and matches_signature(frame, cached_signature)
+    print(f"Ticket modal is iframe {frame['index']} ({'cached signature' if from_cache else 'matched by src and content'})")
+    cache.put(event_url, "ticket_iframe", iframe_signature(frame))
+    return frame['element']
+
+# Resolves a whole {field: [xpath, ...]} table in one round trip: for every field the
+# candidates are tried in order and the first displayed match wins
+RESOLVE_FIELDS_SCRIPT = """
+var table = arguments[0];
+var resolved = {};
+function displayed(element) {
+    var rect = element.getBoundingClientRect();
+    var style = window.getComputedStyle(element);
+    return rect.width > 0 && rect.height > 0 && style.visibility !== 'hidden' && style.display !== 'none';
+}
+Object.keys(table).forEach(function (field) {
+    for (var i = 0; i < table[field].length && !resolved[field]; i++) {
+        var matches = document.evaluate(table[field][i], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (var j = 0; j < matches.snapshotLength; j++) {
+            if (displayed(matches.snapshotItem(j))) {
+                resolved[field] = {element: matches.snapshotItem(j), selector: table[field][i]};
+                break;
+            }
+        }
+    }
+});
+return resolved;
+"""
+
+def resolve_fields(driver, selector_table):
+    """Find the first displayed match for every field in one execute_script call
+    
+    Returns {field: (element, selector that matched)}; fields with no visible match are left out.
+    """
+    resolved = driver.execute_script(RESOLVE_FIELDS_SCRIPT, selector_table) or {}
+    return {field: (match['element'], match['selector']) for field, match in resolved.items()}
+
+REGISTRATION_FIELD_LABELS = {
+    'first_name': 'First Name',
+    'last_name': 'Last Name',
+    'email': 'Email',
+    'confirm_email': 'Confirm Email',
+    'address': 'Address',
+    'city': 'City',
+    'zip_code': 'Zip Code',
+}
+
+# A registration only counts as done when these are filled in
+REQUIRED_REGISTRATION_FIELDS = ('first_name', 'last_name', 'email')
+
+FALLBACK_ADDRESS = {'address': "47111 Mission Falls Ct", 'city': 'Fremont', 'zip_code': '94539'}
+
+def registration_field_values(form_data):
+    """Text values to type into the registration form, in form order
+    
+    Missing fields are skipped, except that the site coordinator email stands in for
+    a missing email and the Age Well Center address for a missing address.
+    """
+    def present(field):
+        value = form_data.get(field, '')
+        return value if value and value.lower() != 'none' else None
+    
+    email = present('email') or SITE_COORDINATOR_EMAIL
+    values = {'first_name': present('first_name'), 'last_name': present('last_name'), 'email': email, 'confirm_email': email}
+    if present('address'):
+        values.update(address=present('address'), city=present('city'), zip_code=present('zip_code'))
+    else:
+        values.update(FALLBACK_ADDRESS)
+    return {field: value for field, value in values.items() if value}
+
+def missing_registration_fields(form_data):
+    """Labels of the required fields form_data has no value for (by the rules of registration_field_values)"""
+    values = registration_field_values(form_data)
+    return [REGISTRATION_FIELD_LABELS[field] for field in REQUIRED_REGISTRATION_FIELDS if field not in values]
+
+# Sets every value with the native value setter (so React notices), fires input/change/blur,
+# then reads every value back once all of them are set
+BULK_FILL_SCRIPT = """
+var entries = arguments[0];
+entries.forEach(function (entry) {
+    var element = entry[0];
+    var prototype = element instanceof HTMLTextAreaElement ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+    element.focus();
+    Object.getOwnPropertyDescriptor(prototype, 'value').set.call(element, entry[1]);
+    element.dispatchEvent(new Event('input', {bubbles: true}));
+    element.dispatchEvent(new Event('change', {bubbles: true}));
+    element.blur();
+});
+return entries.map(function (entry) { return entry[0].value; });
+"""
+
+def fill_text_fields(driver, entries):
+    """Fill [(label, element, value)], in one script call when BULK_FILL_FIELDS is on
+    
+    Fields whose read-back value doesn't match (or all of them in send_keys mode)
+    are typed with clear() + send_keys(). Returns the labels that could not be filled.
+    """
+    pending = entries
+    if BULK_FILL_FIELDS and entries:
+        try:
+            read_back = driver.execute_script(BULK_FILL_SCRIPT, [[element, value] for _, element, value in entries])
+            pending = []
+            for (label, element, value), actual in zip(entries, read_back):
+                if actual == value:
+                    print(f"  Filled {label}: {value}")
+                else:
+                    pending.append((label, element, value))
+            if pending:
+                print(f"  {len(pending)} field(s) did not keep their value, typing them instead")
+        except Exception as e:
+            print(f"  Bulk fill failed, typing fields instead: {e}")
+    
+    failed = []
+    for label, element, value in pending:
+        try:
+            element.clear()
+            element.send_keys(value)
+            print(f"  Filled {label}: {value}")
+        except Exception as e:
+            print(f"  Could not fill {label}: {e}")
+            failed.append(label)
+    return failed
+
+# A fingerprint of the form currently on the page: the tag, type and name of every visible control
+FORM_SIGNATURE_SCRIPT = """
+var controls = Array.from(document.querySelectorAll('input, select, textarea')).filter(function (control) {
+    return control.type !== 'hidden';
+}).map(function (control) {
+    return control.tagName.toLowerCase() + ':' + (control.type || '') + ':' + (control.name || '');
+});
+return Array.from(new Set(controls)).sort().join('|');
+"""
+
+class LearnedLocators:
+    """Selectors that matched on earlier runs, per event URL and form signature
+    
+    ordered() puts the learned selector in front of a candidate list and remember()
+    records the one that matched this time, so a miss re-learns on its own.
+    """
+    
+    def __init__(self, driver, event_url, cache=None):
+        self.cache = cache or get_locator_cache()
+        self.event_url = event_url
+        try:
+            signature = driver.execute_script(FORM_SIGNATURE_SCRIPT) or ""
+        except Exception as e:
+            print(f"  Could not read the form signature: {e}")
+            signature = ""
+        self.name = f"selectors:{hashlib.sha256(signature.encode('utf-8')).hexdigest()[:16]}"
+        self.learned = dict(self.cache.get(event_url, self.name) or {})
+    
+    def ordered(self, field, candidates):
+        learned = self.learned.get(field)
+        if learned not in candidates:
+            return list(candidates)
+        return [learned] + [candidate for candidate in candidates if candidate != learned]
+    
+    def remember(self, field, selector):
+        if self.learned.get(field) != selector:
+            self.learned[field] = selector
+            self.cache.put(self.event_url, self.name, dict(self.learned))
+
+# Snapshot of every radio group in one round trip: question text, and each option's label,
+# id, checked state and input element
+RADIO_GROUPS_SNAPSHOT_SCRIPT = """
+var candidates = Array.from(document.querySelectorAll('[role="radiogroup"], div.eds-radio'));
+var groups = candidates.filter(function (group) {
+    return !candidates.some(function (other) { return other !== group && group.contains(other); });
+});
+function textOf(ids) {
+    return ids.split(' ').map(function (id) { return document.getElementById(id); })
+        .filter(Boolean).map(function (element) { return element.innerText; }).join(' ');
+}
+return groups.map(function (group, index) {
+    var fieldset = group.closest('fieldset');
+    var legend = fieldset && fieldset.querySelector('legend');
+    var question = (group.getAttribute('aria-labelledby') && textOf(group.getAttribute('aria-labelledby')))
+        || group.getAttribute('aria-label') || (legend && legend.innerText) || '';
+    var options = Array.from(group.querySelectorAll('input[type="radio"]')).map(function (input) {
+        var label = (input.id && document.querySelector('label[for="' + CSS.escape(input.id) + '"]')) || input.closest('label');
+        return {input: input, id: input.id, value: input.value, checked: input.checked,
+                label: label ? label.innerText : (input.parentElement ? input.parentElement.innerText : '')};
+    });
+    return {index: index, question: question, text: group.innerText, options: options};
+});
+"""
+
+# Clicks each chosen option (through its label, like a person would), forcing checked + change
+# events when the click didn't take, and reports which ones ended up checked
+CLICK_RADIO_OPTIONS_SCRIPT = """
+return arguments[0].map(function (input) {
+    var label = (input.id && document.querySelector('label[for="' + CSS.escape(input.id) + '"]')) || input.closest('label');
+    input.scrollIntoView({block: 'center'});
+    (label || input).click();
+    if (!input.checked) {
+        input.click();
+    }
+    if (!input.checked) {
+        Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'checked').set.call(input, true);
+        input.dispatchEvent(new Event('input', {bubbles: true}));
+        input.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+    return input.checked;
+});
+"""
+
+def registration_radio_answers(form_data):
+    """[(step, question keywords, option label)] for the radio questions this registrant should answer"""
+    answers = []
+    if form_data.get('age_confirmation', '').lower() == 'yes':
+        answers.append(("55+ age confirmation", ('i am an older adult age 55 or older', 'older adult age 55'), 'Yes'))
+    if form_data.get('location_confirmation', '').lower() == 'yes':
+        answers.append(("Alameda County confirmation", ('i live in alameda county', ('yes i do', 'no i do not')), 'Yes I do'))
+    if HLF_BUS_OPTION:
+        answers.append(("HLF Bus option", ('hlf provided bus', 'large sites only'), 'HLF Provided Bus'))
+    if SITE_COORDINATOR_BUS_CONFIRMATION:
+        answers.append(("site coordinator bus confirmation",
+                        ('have the site coordinator confirmed the bus', 'site coordinator confirmed'), 'Yes'))
+    if form_data.get('lunch_preference', '').lower() == 'vegetarian':
+        answers.append(("lunch preference", (('vegetarian lunch', 'meat option lunch'),), 'Vegetarian Lunch'))
+    answers.append(("liability agreement", ('yes, i agree',), 'Yes, I agree'))
+    return answers
+
+def select_radio_answers(driver, answers):
+    """Answer radio questions from one snapshot and one batched click, returning the unanswered ones
+    
+    A group matches when its question or text contains one of the keywords (a tuple of
+    phrases matches only when all of them appear); the option whose label starts with
+    the wanted label (case-insensitively) is the one clicked.
+    """
+    groups = driver.execute_script(RADIO_GROUPS_SNAPSHOT_SCRIPT) or []
+    print(f"  Found {len(groups)} radio groups")
+    
+    chosen, unanswered = [], []
+    for step, keywords, option_label in answers:
+        option = None
+        for group in groups:
+            haystack = f"{group['question']} {group['text']}".lower()
+            if any(all(phrase in haystack for phrase in ((keyword,) if isinstance(keyword, str) else keyword))
+                   for keyword in keywords):
+                option = next((candidate for candidate in group['options']
+                               if candidate['label'].strip().lower().startswith(option_label.lower())), None)
+                if option:
+                    break
+        if not option:
+            unanswered.append((step, keywords, option_label))
+        elif option['checked']:
+            print(f"  '{option_label}' already selected for {step}")
+        else:
+            chosen.append((step, option_label, option))
     
-    if form_fields:
-        print("\n" + "=" * 50)
-        print("EXTRACTED FORM FIELDS:")
-        print("=" * 50)
-        
-        for field, value in form_fields.items():
-            confidence = confidence_scores.get(field, 0.0)
-            print(f"{field.replace('_', ' ').title()}: {value}")
-            print(f"  Confidence: {confidence:.2f}")
-            print()
-        
-        print("=" * 50)
-        
-        # Calculate average confidence
-        if confidence_scores:
-            avg_confidence = sum(confidence_scores.values()) / len(confidence_scores)
-            print(f"\n📊 Average confidence: {avg_confidence:.2f}")
-        
-        print(f"\n✅ Successfully extracted {len(form_fields)} fields!")
-        
-        return form_fields
-    else:
-        print("No form fields could be extracted.")
-        return {}
+    if chosen:
+        checked = driver.execute_script(CLICK_RADIO_OPTIONS_SCRIPT, [option['input'] for _, _, option in chosen])
+        for (step, option_label, option), is_checked in zip(chosen, checked):
+            if is_checked:
+                print(f"  Selected '{option_label}' for {step}")
+            else:
+                print(f"  Could not select '{option_label}' for {step}")
+    return unanswered
 
-def fill_registration_form(driver, form_data):
-    """Fill the registration form with extracted data"""
+def fill_registration_form(driver, form_data, locators=None):
+    """Fill the registration form with extracted data
+    
+    locators are the LearnedLocators for this form; they are created here when not given.
+    Returns what could not be filled: text fields that failed, required fields with no
+    value or no input on the page, and the rest of the form if a step raised.
+    """
     print("\n=== Filling registration form ===")
+    unfilled = []
     
     try:
-        # Wait for form to load
-        time.sleep(3)
-        
-        # Optimized field mapping with minimal selectors
+        # Preferred selector per field, tried before the longer candidate lists below
         field_mapping = {
             'first_name': "//input[contains(@name, 'first') or contains(@placeholder, 'First')]",
             'last_name': "//input[contains(@name, 'last') or contains(@placeholder, 'Last')]",
@@ -421,91 +2414,41 @@ def fill_registration_form(driver, form_data):
         
         from selenium.webdriver.support.ui import Select
         
-        # Step 1: Fill First Name
-        print("\n=== Step 1: Filling First Name ===")
-        value = form_data.get('first_name', '')
-        if value and value.lower() != 'none':
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['first_name'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(value)
-                    print(f"  Filled First Name: {value}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  First Name field not visible.")
-            except Exception as e:
-                print(f"  Could not fill First Name: {e}")
-        
-        # Step 2: Fill Last Name
-        print("\n=== Step 2: Filling Last Name ===")
-        value = form_data.get('last_name', '')
-        if value and value.lower() != 'none':
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['last_name'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(value)
-                    print(f"  Filled Last Name: {value}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  Last Name field not visible.")
-            except Exception as e:
-                print(f"  Could not fill Last Name: {e}")
-        
-        # Step 3: Fill Email
-        print("\n=== Step 3: Filling Email ===")
-        value = form_data.get('email', '')
-        if value and value.lower() != 'none':
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['email'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(value)
-                    print(f"  Filled Email: {value}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  Email field not visible.")
-            except Exception as e:
-                print(f"  Could not fill Email: {e}")
-        else:
-            # Use site coordinator email as fallback
-            fallback_email = SITE_COORDINATOR_EMAIL
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['email'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(fallback_email)
-                    print(f"  Filled Email (fallback): {fallback_email}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  Email field not visible.")
-            except Exception as e:
-                print(f"  Could not fill Email: {e}")
-        
-        # Step 4: Fill Confirm Email
-        print("\n=== Step 4: Filling Confirm Email ===")
-        email_value = form_data.get('email', '')
-        if email_value and email_value.lower() != 'none':
-            confirm_value = email_value
-        else:
-            confirm_value = SITE_COORDINATOR_EMAIL  # Use fallback email
-        
-        try:
-            element = driver.find_element(By.XPATH, field_mapping['confirm_email'])
-            if element.is_displayed():
-                element.clear()
-                element.send_keys(confirm_value)
-                print(f"  Filled Confirm Email: {confirm_value}")
-                time.sleep(FIELD_FILL_RATE_LIMIT)
-            else:
-                print("  Confirm Email field not visible.")
-        except Exception as e:
-            print(f"  Could not fill Confirm Email: {e}")
+        # Wait for the form to load
+        if not wait_for_any_visible(driver, [field_mapping['first_name'], field_mapping['email']], FORM_LOAD_TIMEOUT):
+            print(f"  Registration form did not appear within {FORM_LOAD_TIMEOUT}s, trying anyway")
+        
+        # Resolve every field in one round trip, trying the selector learned on earlier runs,
+        # then the preferred selector, then the rest
+        locators = locators or LearnedLocators(driver, EVENTBRITE_URL)
+        selector_table = {field: [selector] + [candidate for candidate in field_selectors.get(field, []) if candidate != selector]
+                          for field, selector in field_mapping.items()}
+        for field, candidates in field_selectors.items():
+            selector_table.setdefault(field, candidates)
+        selector_table = {field: locators.ordered(field, candidates) for field, candidates in selector_table.items()}
+        resolved = resolve_fields(driver, selector_table)
+        for field, (element, selector) in resolved.items():
+            locators.remember(field, selector)
+        resolved_fields = {field: element for field, (element, selector) in resolved.items()}
+        print(f"  Resolved {len(resolved)}/{len(selector_table)} fields in one call")
+        for field, (element, selector) in resolved.items():
+            print(f"    {field}: {selector}")
+        
+        # Steps 1-4, 6, 7 and 9: Fill the text fields
+        print("\n=== Steps 1-9: Filling text fields ===")
+        field_values = registration_field_values(form_data)
+        text_fields = [(REGISTRATION_FIELD_LABELS[field], resolved_fields.get(field), value)
+                       for field, value in field_values.items()]
+        for label, element, value in text_fields:
+            if not element:
+                print(f"  {label} field not found or not visible.")
+        unfilled += [REGISTRATION_FIELD_LABELS[field] for field in REQUIRED_REGISTRATION_FIELDS
+                     if field not in field_values or field not in resolved_fields]
+        unfilled += fill_text_fields(driver, [entry for entry in text_fields if entry[1]])
         
         # Step 5: Uncheck "Keep me updated" checkbox
         print("\n=== Step 5: Unchecking 'Keep me updated' checkbox ===")
-        time.sleep(2)
+        wait_for_settled(driver)
         
         try:
             checkbox = driver.find_element(By.XPATH, "//div[contains(@class, 'eds-checkbox')]//input[@type='checkbox']")
@@ -514,64 +2457,11 @@ def fill_registration_form(driver, form_data):
                 wrapper = driver.find_element(By.XPATH, "//div[contains(@class, 'eds-checkbox')]")
                 wrapper.click()
                 print("  Clicked 'Keep me updated' checkbox wrapper to uncheck it.")
-                time.sleep(FIELD_FILL_RATE_LIMIT)
             else:
                 print("  'Keep me updated' checkbox not found or already unchecked.")
         except Exception as e:
             print(f"  Could not handle 'Keep me updated' checkbox: {e}")
         
-        # Step 6: Fill Address
-        print("\n=== Step 6: Filling Address ===")
-        value = form_data.get('address', '')
-        if value and value.lower() != 'none':
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['address'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(value)
-                    print(f"  Filled Address: {value}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  Address field not visible.")
-            except Exception as e:
-                print(f"  Could not fill Address: {e}")
-        else:
-            # Use fallback address
-            fallback_address = "47111 Mission Falls Ct"
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['address'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(fallback_address)
-                    print(f"  Filled Address (fallback): {fallback_address}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  Address field not visible.")
-            except Exception as e:
-                print(f"  Could not fill Address: {e}")
-        
-        # Step 7: Fill City
-        print("\n=== Step 7: Filling City ===")
-        address_value = form_data.get('address', '')
-        if address_value and address_value.lower() != 'none':
-            value = form_data.get('city', '')
-        else:
-            # Use fallback city when address is None
-            value = 'Fremont'
-        
-        if value and value.lower() != 'none':
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['city'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(value)
-                    print(f"  Filled City: {value}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  City field not visible.")
-            except Exception as e:
-                print(f"  Could not fill City: {e}")
-        
         # Step 8: Fill State (Dropdown)
         print("\n=== Step 8: Filling State (Dropdown) ===")
         address_value = form_data.get('address', '')
@@ -585,39 +2475,16 @@ def fill_registration_form(driver, form_data):
             state_value = 'California'  # Convert CA to California for dropdown
         
         try:
-            element = driver.find_element(By.XPATH, field_mapping['state'])
-            if element.is_displayed():
+            element = resolved_fields.get('state')
+            if element:
                 select_element = Select(element)
                 select_element.select_by_visible_text('California')
                 print(f"  Selected State: California")
-                time.sleep(FIELD_FILL_RATE_LIMIT)
             else:
-                print("  State dropdown not visible.")
+                print("  State dropdown not found or not visible.")
         except Exception as e:
             print(f"  Could not fill State: {e}")
         
-        # Step 9: Fill Zip Code
-        print("\n=== Step 9: Filling Zip Code ===")
-        address_value = form_data.get('address', '')
-        if address_value and address_value.lower() != 'none':
-            value = form_data.get('zip_code', '')
-        else:
-            # Use fallback zip when address is None
-            value = '94539'
-        
-        if value and value.lower() != 'none':
-            try:
-                element = driver.find_element(By.XPATH, field_mapping['zip_code'])
-                if element.is_displayed():
-                    element.clear()
-                    element.send_keys(value)
-                    print(f"  Filled Zip Code: {value}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
-                else:
-                    print("  Zip Code field not visible.")
-            except Exception as e:
-                print(f"  Could not fill Zip Code: {e}")
-        
         # Step 10: Fill Country - Select United States
         print("\n=== Step 10: Filling Country ===")
         country_value = COUNTRY  # Use the configuration variable
@@ -633,11 +2500,11 @@ def fill_registration_form(driver, form_data):
             "//select[contains(@name, 'country') or contains(@id, 'country') or contains(@aria-label, 'country')]",
         ]
         
-        # Wait for dropdowns to be present
-        time.sleep(2)
+        # Wait for a country dropdown to be present
+        wait_for_any_visible(driver, country_selectors)
         
         country_filled = False
-        for selector in country_selectors:
+        for selector in locators.ordered('country', country_selectors):
             try:
                 elements = driver.find_elements(By.XPATH, selector)
                 print(f"    Found {len(elements)} elements with selector: {selector}")
@@ -685,131 +2552,12 @@ def fill_registration_form(driver, form_data):
         if not country_filled:
             print("  Could not find Country dropdown.")
         else:
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
-
-        # Step 11b: Handle 55+ age confirmation (separate radio group)
-        if form_data.get('age_confirmation', '').lower() == 'yes':
-            print("\n=== Step 11b: Selecting 'Yes' for 55+ age confirmation (separate radio group) ===")
-            try:
-                # Find all radio groups
-                radio_groups = driver.find_elements(By.XPATH, "//div[contains(@class, 'eds-radio') and @role='radiogroup']")
-                print(f"      Found {len(radio_groups)} radio groups")
-                
-                for i, group in enumerate(radio_groups):
-                    group_text = group.text.lower()
-                    print(f"      Radio group {i} text: {group_text}")
-                    
-                    # Look for the 55+ age confirmation radio group
-                    if 'i am an older adult age 55 or older' in group_text or 'older adult age 55' in group_text:
-                        print(f"      Found 55+ age confirmation radio group {i}")
-                        # Look for "Yes" option
-                        try:
-                            yes_option = group.find_element(By.XPATH, ".//div[contains(@class, 'eds-radio__option')]//label[contains(text(), 'Yes')] | .//div[contains(@class, 'eds-radio__option')]//span[contains(text(), 'Yes')]")
-                            if yes_option:
-                                yes_option.click()
-                                print(f"  Selected 'Yes' for 55+ age confirmation radio group {i}")
-                                break
-                        except Exception as e:
-                            print(f"      Could not find 'Yes' option in 55+ group {i}: {e}")
-                            
-            except Exception as e:
-                print(f"  Could not select 'Yes' for 55+ age radio: {e}")
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
-
-        # Step 12b: Handle Alameda County confirmation (separate radio group)
-        if form_data.get('location_confirmation', '').lower() == 'yes':
-            print("\n=== Step 12b: Selecting 'Yes' for Alameda County confirmation (separate radio group) ===")
-            try:
-                radio_groups = driver.find_elements(By.XPATH, "//div[contains(@class, 'eds-radio') and @role='radiogroup']")
-                print(f"      Found {len(radio_groups)} radio groups")
-                
-                for i, group in enumerate(radio_groups):
-                    group_text = group.text.lower()
-                    print(f"      Radio group {i} text: {group_text}")
-                    
-                    # Look for the separate "I live in Alameda County" radio group
-                    if 'i live in alameda county' in group_text or ('yes i do' in group_text and 'no i do not' in group_text):
-                        print(f"      Found 'I live in Alameda County' radio group {i}")
-                        # Look for "Yes I do" option
-                        try:
-                            yes_option = group.find_element(By.XPATH, ".//div[contains(@class, 'eds-radio__option')]//label[contains(text(), 'Yes I do')] | .//div[contains(@class, 'eds-radio__option')]//span[contains(text(), 'Yes I do')]")
-                            if yes_option:
-                                yes_option.click()
-                                print(f"  Selected 'Yes I do' for Alameda County radio group {i}")
-                                break
-                        except Exception as e:
-                            print(f"      Could not find 'Yes I do' option in group {i}: {e}")
-                            
-            except Exception as e:
-                print(f"  Could not select 'Yes' for Alameda County radio: {e}")
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
-
-        # Step 12b2: Handle HLF Bus option (right after Alameda County confirmation)
-        if HLF_BUS_OPTION:
-            print("\n=== Step 12b2: Selecting HLF Bus option ===")
-            try:
-                # Look for the HLF bus option in the transportation radio group
-                radio_groups = driver.find_elements(By.XPATH, "//div[contains(@class, 'eds-radio') and @role='radiogroup']")
-                print(f"      Found {len(radio_groups)} radio groups")
-                
-                for i, group in enumerate(radio_groups):
-                    group_text = group.text.lower()
-                    print(f"      Radio group {i} text: {group_text}")
-                    
-                    # Look for transportation radio group that contains HLF bus option
-                    if 'hlf provided bus' in group_text or 'large sites only' in group_text:
-                        print(f"      Found transportation radio group {i} with HLF bus option")
-                        # Look for "HLF Provided Bus" option
-                        try:
-                            hlf_option = group.find_element(By.XPATH, ".//div[contains(@class, 'eds-radio__option')]//label[contains(text(), 'HLF Provided Bus')] | .//div[contains(@class, 'eds-radio__option')]//span[contains(text(), 'HLF Provided Bus')] | .//div[contains(@class, 'eds-radio__option')]//label[contains(text(), 'hlf provided bus')] | .//div[contains(@class, 'eds-radio__option')]//span[contains(text(), 'hlf provided bus')]")
-                            if hlf_option:
-                                hlf_option.click()
-                                print(f"  Selected 'HLF Provided Bus' option in radio group {i}")
-                                break
-                        except Exception as e:
-                            print(f"      Could not find 'HLF Provided Bus' option in group {i}: {e}")
-                            
-            except Exception as e:
-                print(f"  Could not select HLF Bus option: {e}")
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
-        else:
-            print("\n=== Step 12b2: Skipping HLF Bus option (HLF_BUS_OPTION = False) ===")
+            locators.remember('country', selector)
 
-        # Step 12b3: Handle Site Coordinator Bus Confirmation (right after HLF Bus selection)
-        if SITE_COORDINATOR_BUS_CONFIRMATION:
-            print("\n=== Step 12b3: Selecting 'Yes' for Site Coordinator Bus Confirmation ===")
-            try:
-                # Look for the site coordinator bus confirmation radio group
-                radio_groups = driver.find_elements(By.XPATH, "//div[contains(@class, 'eds-radio') and @role='radiogroup']")
-                print(f"      Found {len(radio_groups)} radio groups")
-                
-                for i, group in enumerate(radio_groups):
-                    group_text = group.text.lower()
-                    print(f"      Radio group {i} text: {group_text}")
-                    
-                    # Look for site coordinator bus confirmation radio group
-                    if 'have the site coordinator confirmed the bus' in group_text or 'site coordinator confirmed' in group_text:
-                        print(f"      Found site coordinator bus confirmation radio group {i}")
-                        # Look for "Yes" option
-                        try:
-                            yes_option = group.find_element(By.XPATH, ".//div[contains(@class, 'eds-radio__option')]//label[contains(text(), 'Yes')] | .//div[contains(@class, 'eds-radio__option')]//span[contains(text(), 'Yes')]")
-                            if yes_option:
-                                yes_option.click()
-                                print(f"  Selected 'Yes' for site coordinator bus confirmation radio group {i}")
-                                break
-                        except Exception as e:
-                            print(f"      Could not find 'Yes' option in site coordinator group {i}: {e}")
-                            
-            except Exception as e:
-                print(f"  Could not select 'Yes' for site coordinator bus confirmation: {e}")
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
-        else:
-            print("\n=== Step 12b3: Skipping Site Coordinator Bus Confirmation (SITE_COORDINATOR_BUS_CONFIRMATION = False) ===")
+        # Steps 11b-12d: Answer the radio questions (55+, Alameda County, HLF bus, site coordinator bus,
+        # lunch, liability) from one snapshot of every radio group, matched by question text
+        print("\n=== Steps 11b-12d: Answering radio questions ===")
+        unanswered = select_radio_answers(driver, registration_radio_answers(form_data))
 
         # Step 12b4: Fill Site/Location Name and Site Coordinator Info (by order, after HLF Bus selection)
         if HLF_BUS_OPTION:
@@ -825,7 +2573,7 @@ def fill_registration_form(driver, form_data):
             
             # Wait for additional fields to appear after HLF Bus selection
             print("  Waiting for additional fields to appear after HLF Bus selection...")
-            time.sleep(3)
+            wait_for_any_visible(driver, ["//input[starts-with(@name, 'buyer.U-') and not(@type='hidden')]"])
             
             # Find all visible input fields with name starting with 'buyer.U-'
             all_inputs = driver.find_elements(By.XPATH, "//input[starts-with(@name, 'buyer.U-') and not(@type='hidden')]")
@@ -836,241 +2584,20 @@ def fill_registration_form(driver, form_data):
             visible_textareas = [ta for ta in all_textareas if ta.is_displayed()]
             print(f"    Found {len(visible_textareas)} visible 'buyer.U-' textarea fields")
             
-            # Fill in order: site/location, coordinator name, coordinator email, coordinator phone
+            # Fill in order: site/location, coordinator name, coordinator email, coordinator phone,
+            # continuing into the textareas if there are more values than inputs
             values = [site_location_value, site_coordinator_value, site_coordinator_email_value, site_coordinator_phone_value]
-            for i, value in enumerate(values):
-                if i < len(visible_inputs):
-                    try:
-                        visible_inputs[i].clear()
-                        visible_inputs[i].send_keys(value)
-                        print(f"  Filled field {i+1} with value: {value}")
-                        time.sleep(FIELD_FILL_RATE_LIMIT)
-                    except Exception as e:
-                        print(f"  Could not fill field {i+1}: {e}")
-                else:
-                    print(f"  Not enough visible input fields to fill value: {value}")
-            # If there are textareas and more values, fill them too
-            for j, ta in enumerate(visible_textareas):
-                idx = len(visible_inputs) + j
-                if idx < len(values):
-                    try:
-                        ta.clear()
-                        ta.send_keys(values[idx])
-                        print(f"  Filled textarea field {idx+1} with value: {values[idx]}")
-                        time.sleep(FIELD_FILL_RATE_LIMIT)
-                    except Exception as e:
-                        print(f"  Could not fill textarea field {idx+1}: {e}")
-
-            # Now select 'Yes' for the site coordinator confirmed bus radio group
-            print(f"\n=== Step 12b5: Selecting 'Yes' for Site Coordinator Confirmed Bus (after HLF Bus selection) ===")
-            try:
-                # Find all radio groups after HLF Bus selection
-                radio_groups = driver.find_elements(By.XPATH, "//div[contains(@class, 'eds-radio')]")
-                print(f"  Found {len(radio_groups)} radio groups after HLF Bus selection")
-                
-                # Debug: Print HTML structure of each radio group
-                for i, group in enumerate(radio_groups):
-                    group_text = group.text.lower()
-                    print(f"  Radio group {i} text: {group_text}")
-                    
-                    # Print HTML structure for debugging
-                    try:
-                        group_html = group.get_attribute('outerHTML')
-                        print(f"  Radio group {i} HTML structure:")
-                        print(f"    {group_html[:500]}...")  # First 500 chars
-                    except Exception as html_error:
-                        print(f"    Could not get HTML for radio group {i}: {html_error}")
-                
-                # Try multiple strategies to find and select the correct radio group
-                selected = False
-                
-                # Strategy 1: Look for radio group that appears after HLF Bus selection (should be the 3rd or 4th radio group)
-                if len(radio_groups) >= 13:
-                    target_group_index = 13  # The site coordinator question is the 14th radio group (index 13)
-                    if target_group_index < len(radio_groups):
-                        print(f"  Trying Strategy 1: Targeting radio group {target_group_index} (should be site coordinator question)")
-                        try:
-                            target_group = radio_groups[target_group_index]
-                            
-                            # Find the radio input directly (not the container)
-                            radio_inputs = target_group.find_elements(By.CSS_SELECTOR, "input[type='radio']")
-                            if radio_inputs:
-                                # Target the first radio input (which should be "Yes")
-                                first_radio_input = radio_inputs[0]
-                                
-                                # Scroll to the element
-                                driver.execute_script("arguments[0].scrollIntoView(true);", first_radio_input)
-                                time.sleep(0.5)
-                                
-                                # Method 1: Try clicking the label first (this often works better)
-                                try:
-                                    radio_id = first_radio_input.get_attribute('id')
-                                    if radio_id:
-                                        # Find the label associated with this radio input
-                                        label = driver.find_element(By.CSS_SELECTOR, f"label[for='{radio_id}']")
-                                        driver.execute_script("arguments[0].scrollIntoView(true);", label)
-                                        time.sleep(0.5)
-                                        label.click()
-                                        print(f"    Clicked label for radio input in radio group {target_group_index}")
-                                        time.sleep(0.5)
-                                except Exception as label_error:
-                                    print(f"    Could not click label: {label_error}")
-                                
-                                # Method 2: Direct click on radio input (if label didn't work)
-                                try:
-                                    first_radio_input.click()
-                                    print(f"    Clicked radio input directly for radio group {target_group_index}")
-                                    time.sleep(0.5)
-                                except Exception as radio_error:
-                                    print(f"    Could not click radio input directly: {radio_error}")
-                                
-                                # Method 3: JavaScript to set checked and trigger events
-                                try:
-                                    driver.execute_script("""
-                                        arguments[0].checked = true;
-                                        arguments[0].click();
-                                        arguments[0].dispatchEvent(new Event('change', { bubbles: true }));
-                                        arguments[0].dispatchEvent(new Event('input', { bubbles: true }));
-                                    """, first_radio_input)
-                                    print(f"    Forced radio input selection with JavaScript for radio group {target_group_index}")
-                                    time.sleep(0.5)
-                                except Exception as js_error:
-                                    print(f"    JavaScript method failed: {js_error}")
-                                
-                                # Method 4: Try clicking the parent container
-                                try:
-                                    parent_container = first_radio_input.find_element(By.XPATH, "./..")
-                                    parent_container.click()
-                                    print(f"    Clicked parent container for radio group {target_group_index}")
-                                    time.sleep(0.5)
-                                except Exception as parent_error:
-                                    print(f"    Could not click parent container: {parent_error}")
-                                
-                                selected = True
-                            else:
-                                print(f"    Could not find radio inputs in radio group {target_group_index}")
-                        except Exception as e:
-                            print(f"    Strategy 1 failed: {e}")
-                
-                # Strategy 2: Look for radio group with simple "yes/no" text
-                if not selected:
-                    for i, group in enumerate(radio_groups):
-                        group_text = group.text.lower()
-                        if 'yes' in group_text and 'no' in group_text and len(group_text.split()) < 10:
-                            print(f"  Trying Strategy 2: Targeting radio group {i} with simple yes/no text")
-                            try:
-                                first_option = group.find_element(By.CSS_SELECTOR, "div.eds-radio__option[data-spec='radio-option-container']")
-                                if first_option:
-                                    driver.execute_script("arguments[0].scrollIntoView(true);", first_option)
-                                    first_option.click()
-                                    print(f"    Clicked first option in radio group {i}")
-                                    time.sleep(0.5)
-                                    
-                                    # Also try JavaScript
-                                    driver.execute_script("""
-                                        arguments[0].click();
-                                        var event = new Event('click', { bubbles: true });
-                                        arguments[0].dispatchEvent(event);
-                                    """, first_option)
-                                    print(f"    Forced click with JavaScript on radio group {i}")
-                                    selected = True
-                                    break
-                            except Exception as e:
-                                print(f"    Strategy 2 failed for group {i}: {e}")
-                
-                # Strategy 3: Try clicking the 3rd radio group specifically (most likely to be site coordinator)
-                if not selected and len(radio_groups) >= 3:
-                    print(f"  Trying Strategy 3: Targeting radio group 2 (3rd radio group)")
-                    try:
-                        target_group = radio_groups[2]  # 3rd radio group (index 2)
-                        first_option = target_group.find_element(By.CSS_SELECTOR, "div.eds-radio__option[data-spec='radio-option-container']")
-                        if first_option:
-                            driver.execute_script("arguments[0].scrollIntoView(true);", first_option)
-                            first_option.click()
-                            print(f"    Clicked first option in radio group 2")
-                            time.sleep(0.5)
-                            
-                            # Also try JavaScript
-                            driver.execute_script("""
-                                arguments[0].click();
-                                var event = new Event('click', { bubbles: true });
-                                arguments[0].dispatchEvent(event);
-                            """, first_option)
-                            print(f"    Forced click with JavaScript on radio group 2")
-                            selected = True
-                    except Exception as e:
-                        print(f"    Strategy 3 failed: {e}")
-                
-                if selected:
-                    print(f"  Successfully selected 'Yes' for site coordinator confirmed bus")
-                else:
-                    print(f"  Could not select 'Yes' for site coordinator confirmed bus with any strategy")
-                    
-            except Exception as e:
-                print(f"  Error selecting site coordinator confirmed bus: {e}")
-            
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
-
-        # Note: Site coordinator fields are now handled in Step 12b4 using order-based filling
-        # Removed duplicate sections 12b6, 12b7, 12b8 to prevent overwriting main email field
-
-        # Step 12c: Handle lunch preference (Vegetarian)
-        if form_data.get('lunch_preference', '').lower() == 'vegetarian':
-            print("\n=== Step 12c: Selecting 'Vegetarian' for lunch preference ===")
-            try:
-                radio_groups = driver.find_elements(By.XPATH, "//div[contains(@class, 'eds-radio') and @role='radiogroup']")
-                print(f"      Found {len(radio_groups)} radio groups")
-                
-                for i, group in enumerate(radio_groups):
-                    group_text = group.text.lower()
-                    print(f"      Radio group {i} text: {group_text}")
-                    
-                    # Look for lunch preference radio group
-                    if 'vegetarian lunch' in group_text and 'meat option lunch' in group_text:
-                        print(f"      Found lunch preference radio group {i}")
-                        # Look for "Vegetarian Lunch" option
-                        try:
-                            veg_option = group.find_element(By.XPATH, ".//div[contains(@class, 'eds-radio__option')]//label[contains(text(), 'Vegetarian Lunch')] | .//div[contains(@class, 'eds-radio__option')]//span[contains(text(), 'Vegetarian Lunch')]")
-                            if veg_option:
-                                veg_option.click()
-                                print(f"  Selected 'Vegetarian Lunch' for lunch preference radio group {i}")
-                                break
-                        except Exception as e:
-                            print(f"      Could not find 'Vegetarian Lunch' option in group {i}: {e}")
-                            
-            except Exception as e:
-                print(f"  Could not select 'Vegetarian' for lunch preference: {e}")
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
+            elements = visible_inputs + visible_textareas
+            for value in values[len(elements):]:
+                print(f"  Not enough visible input fields to fill value: {value}")
+            unfilled += fill_text_fields(driver, [(f"Site coordinator field {i+1}", element, value)
+                                                  for i, (element, value) in enumerate(zip(elements, values))])
 
-        # Step 12d: Handle liability agreement
-        print("\n=== Step 12d: Selecting 'Yes, I agree' for liability agreement ===")
-        try:
-            radio_groups = driver.find_elements(By.XPATH, "//div[contains(@class, 'eds-radio') and @role='radiogroup']")
-            print(f"      Found {len(radio_groups)} radio groups")
-            
-            for i, group in enumerate(radio_groups):
-                group_text = group.text.lower()
-                print(f"      Radio group {i} text: {group_text}")
-                
-                # Look for liability agreement radio group
-                if 'yes, i agree' in group_text:
-                    print(f"      Found liability agreement radio group {i}")
-                    # Look for "Yes, I agree" option
-                    try:
-                        agree_option = group.find_element(By.XPATH, ".//div[contains(@class, 'eds-radio__option')]//label[contains(text(), 'Yes, I agree')] | .//div[contains(@class, 'eds-radio__option')]//span[contains(text(), 'Yes, I agree')]")
-                        if agree_option:
-                            agree_option.click()
-                            print(f"  Selected 'Yes, I agree' for liability agreement radio group {i}")
-                            break
-                    except Exception as e:
-                        print(f"      Could not find 'Yes, I agree' option in group {i}: {e}")
-                        
-        except Exception as e:
-            print(f"  Could not select 'Yes, I agree' for liability agreement: {e}")
-        print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-        time.sleep(FIELD_FILL_RATE_LIMIT)
+        # Step 12b5: Questions revealed by the HLF Bus selection (e.g. site coordinator confirmed bus)
+        if unanswered:
+            print(f"\n=== Step 12b5: Answering questions that appeared after the HLF Bus selection ===")
+            for step, keywords, option_label in select_radio_answers(driver, unanswered):
+                print(f"  Could not answer {step}: no matching radio group with a '{option_label}' option")
         
         # Step 11: Check 55+ age confirmation
         print("\n=== Step 11: Checking 55+ age confirmation ===")
@@ -1097,7 +2624,7 @@ def fill_registration_form(driver, form_data):
         ]
         
         age_checked = False
-        for selector in age_checkbox_selectors:
+        for selector in locators.ordered('age_checkbox', age_checkbox_selectors):
             try:
                 elements = driver.find_elements(By.XPATH, selector)
                 print(f"    Found {len(elements)} elements with selector: {selector}")
@@ -1121,16 +2648,13 @@ def fill_registration_form(driver, form_data):
         
         if not age_checked:
             print("  Could not find or check 55+ age confirmation checkbox.")
-        
-        print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-        time.sleep(FIELD_FILL_RATE_LIMIT)
+        else:
+            locators.remember('age_checkbox', selector)
         
         # Step 12: Alameda County is handled by radio button selection above
         print("\n=== Step 12: Alameda County confirmation handled by radio button ===")
         print("  Alameda County confirmation is a radio button, not a checkbox.")
         print("  Radio button selection was already handled in Step 12b.")
-        print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-        time.sleep(FIELD_FILL_RATE_LIMIT)
         
         # Step 13: Check HLF bus option
         print("\n=== Step 13: Checking HLF bus option ===")
@@ -1150,7 +2674,7 @@ def fill_registration_form(driver, form_data):
         ]
         
         hlf_checked = False
-        for selector in hlf_checkbox_selectors:
+        for selector in locators.ordered('hlf_checkbox', hlf_checkbox_selectors):
             try:
                 elements = driver.find_elements(By.XPATH, selector)
                 for element in elements:
@@ -1166,9 +2690,8 @@ def fill_registration_form(driver, form_data):
         
         if not hlf_checked:
             print("  Could not find or check HLF bus option checkbox.")
-        
-        print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-        time.sleep(FIELD_FILL_RATE_LIMIT)
+        else:
+            locators.remember('hlf_checkbox', selector)
         
         # Step 14: Check site coordinator confirmed bus
         print("\n=== Step 14: Checking site coordinator confirmed bus ===")
@@ -1202,9 +2725,6 @@ def fill_registration_form(driver, form_data):
         if not coordinator_checked:
             print("  Could not find or check site coordinator confirmed bus checkbox.")
         
-        print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds...")
-        time.sleep(FIELD_FILL_RATE_LIMIT)
-        
         print("  Form filling completed!")
         
         # Handle checkboxes for age confirmation and location confirmation
@@ -1228,7 +2748,7 @@ def fill_registration_form(driver, form_data):
             ]
             
             age_checked = False
-            for selector in age_checkbox_selectors:
+            for selector in locators.ordered('age_checkbox', age_checkbox_selectors):
                 try:
                     elements = driver.find_elements(By.XPATH, selector)
                     for element in elements:
@@ -1245,15 +2765,12 @@ def fill_registration_form(driver, form_data):
             if not age_checked:
                 print("  Could not find age confirmation checkbox.")
             else:
-                print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds before next checkbox...")
-                time.sleep(FIELD_FILL_RATE_LIMIT)
+                locators.remember('age_checkbox', selector)
         
         # Location confirmation (Alameda County) is handled by radio button selection above
         if CHECK_LOCATION_CONFIRMATION and form_data.get('location_confirmation') == 'Yes':
             print("  Location confirmation (Alameda County) is handled by radio button selection.")
             print("  Radio button selection was already handled in Step 12b.")
-            print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds before next checkbox...")
-            time.sleep(FIELD_FILL_RATE_LIMIT)
         
         # Check HLF Provided Bus option
         if CHECK_HLF_BUS:
@@ -1292,9 +2809,6 @@ def fill_registration_form(driver, form_data):
         
             if not bus_checked:
                 print("  Could not find HLF Provided Bus checkbox.")
-            else:
-                print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds before next checkbox...")
-                time.sleep(FIELD_FILL_RATE_LIMIT)
         
         # Check site coordinator confirmation (after bus option)
         if CHECK_COORDINATOR_CONFIRMATION:
@@ -1330,9 +2844,6 @@ def fill_registration_form(driver, form_data):
         
             if not coordinator_checked:
                 print("  Could not find site coordinator confirmation checkbox.")
-            else:
-                print(f"  Waiting {FIELD_FILL_RATE_LIMIT} seconds before completing...")
-                time.sleep(FIELD_FILL_RATE_LIMIT)
         
         print("  Checkbox handling completed!")
         
@@ -1353,7 +2864,6 @@ def fill_registration_form(driver, form_data):
                     driver.execute_script("arguments[0].scrollIntoView(true);", label)
                     label.click()
                     print(f"  Checked liability checkbox {idx+1}")
-                    time.sleep(FIELD_FILL_RATE_LIMIT)
                 except Exception as e:
                     print(f"  Could not check liability checkbox {idx+1}: {e}")
         except Exception as e:
@@ -1361,91 +2871,305 @@ def fill_registration_form(driver, form_data):
         
     except Exception as e:
         print(f"Error filling form: {e}")
+        unfilled.append(f"rest of the form ({e})")
+    
+    if unfilled:
+        print(f"  Could not fill: {', '.join(unfilled)}")
+    return unfilled
 
-def take_screenshot_and_extract_text(driver, element=None, filename="screenshot.png"):
-    """Take a screenshot and extract text from it"""
+def take_screenshot_and_extract_text(driver, element=None):
+    """Take a screenshot and extract text from it
+    
+    The PNG stays in memory, so several browser sessions can do this at once.
+    """
     try:
         if element:
             # Take screenshot of specific element
-            element.screenshot(filename)
+            screenshot = element.screenshot_as_png
         else:
             # Take screenshot of entire page
-            driver.save_screenshot(filename)
+            screenshot = driver.get_screenshot_as_png()
         
         # Extract text from the screenshot
-        extracted_text = extract_text_from_image(filename)
-        
-        # Clean up the screenshot file
-        if os.path.exists(filename):
-            os.remove(filename)
-        
-        return extracted_text
+        return extract_text_from_image_bytes(screenshot, "image/png", source="screenshot")
         
     except Exception as e:
         print(f"Error taking screenshot and extracting text: {e}")
         return None
 
-# Set up the driver
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()))
+# Returns every data:image <img> on the page with its natural size in one round trip
+COLLECT_INLINE_IMAGES_SCRIPT = """
+return Array.from(document.images).map(function (img) {
+    return {src: img.currentSrc || img.src, width: img.naturalWidth, height: img.naturalHeight};
+}).filter(function (image) {
+    return image.src && image.src.indexOf('data:image') === 0;
+});
+"""
 
-try:
+class InlineImageExtraction:
+    """Extracts text from a page's inline images in the background
+    
+    Creating it collects the images, drops tiny and duplicate ones and starts the
+    extractions; collect() waits for whatever finishes within the page's time budget.
+    """
+    
+    def __init__(self, driver, time_budget=INLINE_IMAGE_TIME_BUDGET, max_workers=INLINE_IMAGE_MAX_WORKERS):
+        self.deadline = time.monotonic() + time_budget
+        self.futures = {}
+        
+        try:
+            images = driver.execute_script(COLLECT_INLINE_IMAGES_SCRIPT) or []
+        except Exception as e:
+            print(f"  Could not collect inline images: {e}")
+            images = []
+        
+        seen_hashes = set()
+        skipped_small = skipped_duplicate = 0
+        
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        for index, image in enumerate(images):
+            if min(image['width'], image['height']) < INLINE_IMAGE_MIN_SIDE:
+                skipped_small += 1
+                continue
+            
+            # Identical images have identical data: URIs, so hashing the URI finds duplicates
+            # without decoding; each image is decoded once, by its worker
+            image_hash = hashlib.sha256(image['src'].encode('utf-8')).hexdigest()
+            if image_hash in seen_hashes:
+                skipped_duplicate += 1
+                continue
+            seen_hashes.add(image_hash)
+            
+            future = self.executor.submit(extract_text_from_data_uri, image['src'], "inline_image")
+            self.futures[future] = index
+        
+        print(f"  Found {len(images)} inline image(s): extracting {len(self.futures)}, "
+              f"skipped {skipped_small} small and {skipped_duplicate} duplicate")
+    
+    def collect(self):
+        """Wait for the remaining budget and return {image index: extracted text}"""
+        done, not_done = wait(self.futures, timeout=max(0.0, self.deadline - time.monotonic()))
+        results = {}
+        
+        for future in done:
+            index = self.futures[future]
+            try:
+                extracted_text = future.result()
+            except Exception as e:
+                print(f"  Error processing image {index}: {e}")
+                continue
+            if extracted_text:
+                results[index] = extracted_text
+                print(f"  Image {index}: Extracted text: {extracted_text}")
+        
+        if not_done:
+            print(f"  {len(not_done)} inline image(s) did not finish within the time budget")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+class RegistrationError(Exception):
+    """A registration step that the rest of the checkout can't continue without failed"""
+
+class RegistrationDataError(RegistrationError):
+    """The registrant's data can't complete the form, so retrying won't help"""
+
+_chromedriver_path = None
+_chromedriver_path_lock = threading.Lock()
+
+def get_chromedriver_path():
+    """Resolve (and download if needed) the chromedriver binary once per process"""
+    global _chromedriver_path
+    with _chromedriver_path_lock:
+        if _chromedriver_path is None:
+            _chromedriver_path = ChromeDriverManager().install()
+    return _chromedriver_path
+
+def create_driver(headless=False, profile_dir=os.path.join(BROWSER_PROFILE_DIR, "single"), lean=LEAN_BROWSER):
+    """Start a Chrome session on a persistent profile (profile_dir=None for a throwaway one)
+    
+    lean always runs headless, without GPU or extensions, and blocks image, font,
+    media and tracker requests. Blocking applies to the page and the iframes it
+    renders in-process; an out-of-process iframe still loads its own.
+    """
+    options = webdriver.ChromeOptions()
+    if profile_dir:
+        options.add_argument(f"--user-data-dir={os.path.abspath(profile_dir)}")
+    if headless or lean:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1280,1600")
+    if lean:
+        options.add_argument("--disable-gpu")
+        options.add_argument("--disable-extensions")
+    if REPORT_PAGE_LOADS:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    driver = webdriver.Chrome(service=Service(get_chromedriver_path()), options=options)
+    
+    if lean:
+        blocked_urls = LEAN_BLOCKED_RESOURCE_PATTERNS + [f"*{domain}*" for domain in LEAN_BLOCKED_TRACKER_DOMAINS]
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+    return driver
+
+class PageLoadReport:
+    """Bytes transferred and page-ready time for each step of one checkout
+    
+    Reads the browser's performance log, so it only has numbers when the driver was
+    started with REPORT_PAGE_LOADS on. A step covers the time and network traffic
+    since the previous step ended (or since start() was last called).
+    """
+    
+    def __init__(self, driver):
+        self.driver = driver
+        self.enabled = REPORT_PAGE_LOADS
+        self.steps = []
+        self.network_totals()  # Drop what earlier registrants in this session left in the log
+        self.start()
+    
+    def start(self):
+        """Time the next step from now, leaving out work that isn't page loading"""
+        self.started = time.perf_counter()
+    
+    def network_totals(self):
+        """Sum the network events logged since the last call"""
+        totals = {'bytes': 0, 'requests': 0, 'blocked': 0}
+        if not self.enabled:
+            return totals
+        try:
+            entries = self.driver.get_log("performance")
+        except Exception as e:
+            print(f"  Page load report unavailable (no performance log): {e}")
+            self.enabled = False
+            return totals
+        
+        for entry in entries:
+            event = json.loads(entry["message"])["message"]
+            if event["method"] == "Network.loadingFinished":
+                totals['bytes'] += int(event["params"].get("encodedDataLength", 0))
+                totals['requests'] += 1
+            elif event["method"] == "Network.loadingFailed" and event["params"].get("blockedReason"):
+                totals['blocked'] += 1
+        return totals
+    
+    def step(self, name):
+        """End the current step once its page is ready and print what it cost"""
+        ready_time = time.perf_counter() - self.started
+        totals = self.network_totals()
+        if self.enabled:
+            self.steps.append({'step': name, 'ready_time': round(ready_time, 3), **totals})
+            print(f"  📶 {name}: ready in {ready_time:.2f}s, {totals['bytes'] / 1024:.1f} KB over "
+                  f"{totals['requests']} request(s), {totals['blocked']} blocked")
+        self.start()
+    
+    def summary(self):
+        if not self.steps:
+            return
+        total_time = sum(step['ready_time'] for step in self.steps)
+        total_bytes = sum(step['bytes'] for step in self.steps)
+        total_requests = sum(step['requests'] for step in self.steps)
+        total_blocked = sum(step['blocked'] for step in self.steps)
+        print(f"📶 Page loads: {total_time:.2f}s ready time, {total_bytes / 1024:.1f} KB over "
+              f"{total_requests} request(s), {total_blocked} blocked")
+
+def reset_session(driver):
+    """Clear the event site's storage so the next registrant starts clean, keeping the process warm"""
+    driver.switch_to.default_content()
+    event_url = urllib.parse.urlsplit(EVENTBRITE_URL)
+    driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": f"{event_url.scheme}://{event_url.netloc}",
+                                                          "storageTypes": SESSION_RESET_STORAGE_TYPES})
+    if SESSION_RESET_CLEARS_COOKIES:
+        driver.delete_all_cookies()
+    driver.get("about:blank")
+
+class BrowserSessionPool:
+    """Warm Chrome sessions reused across registrants
+    
+    Each slot has its own profile directory, since running Chrome instances can't
+    share one. A session is started the first time its slot is used, reset between
+    registrants, and only restarted after a registration fails in it.
+    """
+    
+    def __init__(self, size, headless=REGISTRATION_HEADLESS, profile_root=BROWSER_PROFILE_DIR):
+        self.headless = headless
+        self.profile_root = profile_root
+        self.idle = queue.Queue()
+        for slot in range(size):
+            self.idle.put((slot, None))
+    
+    @contextlib.contextmanager
+    def session(self):
+        """Borrow a driver; it goes back reset, or is quit if the block raised"""
+        slot, driver = self.idle.get()
+        healthy = False
+        try:
+            if driver is None:
+                driver = create_driver(self.headless, os.path.join(self.profile_root, f"session-{slot}"))
+            yield driver
+            healthy = True
+        finally:
+            if driver and healthy:
+                try:
+                    reset_session(driver)
+                except Exception as e:
+                    print(f"  Could not reset browser session {slot}, restarting it: {e}")
+                    healthy = False
+            if driver and not healthy:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+                driver = None
+            self.idle.put((slot, driver))
+    
+    def close(self):
+        while not self.idle.empty():
+            slot, driver = self.idle.get()
+            if driver:
+                driver.quit()
+
+def register_attendee(driver, form_data=None):
+    """Walk one Eventbrite checkout in driver, from "Get tickets" to the filled registration form
+    
+    form_data comes from IMAGE_PATH when not given. Returns the page load report's
+    steps. Raises RegistrationError when a step the checkout can't go on without fails,
+    and RegistrationDataError when form_data lacks a required field.
+    """
+    missing = missing_registration_fields(form_data) if form_data is not None else []
+    if missing:
+        raise RegistrationDataError(f"Missing {', '.join(missing)}")
+    
     # Go to the Eventbrite event page
+    page_loads = PageLoadReport(driver)
     driver.get(EVENTBRITE_URL)
 
-    # Wait for the page to load
-    time.sleep(PAGE_LOAD_WAIT)
-
-    # Find and click the "Get tickets" button
-    get_tickets_button = driver.find_element(By.CSS_SELECTOR, "button[class*='ticket']")
-    if get_tickets_button.is_displayed() and get_tickets_button.is_enabled():
+    # Wait for the page to load and the "Get tickets" button to become clickable
+    wait_for_page_ready(driver)
+    get_tickets_button = wait_until(driver, EC.element_to_be_clickable((By.CSS_SELECTOR, "button[class*='ticket']")),
+                                    PAGE_LOAD_TIMEOUT)
+    page_loads.step("event page")
+    if get_tickets_button:
         get_tickets_button.click()
         print("Successfully clicked the 'Get tickets' button.")
     else:
-        print("The 'Get tickets' button is not visible or not enabled.")
-        driver.quit()
-        exit()
+        raise RegistrationError("The 'Get tickets' button is not visible or not enabled.")
 
-    # Wait for the iframe to appear and switch to it
-    time.sleep(IFRAME_WAIT)
+    # Wait for the ticket modal iframe to appear and switch to it
     print("\n=== Looking for iframe ===")
-    iframes = driver.find_elements(By.TAG_NAME, "iframe")
-    print(f"Found {len(iframes)} iframe(s)")
-    
-    if iframes:
-        # Print iframe details
-        for i, iframe in enumerate(iframes):
-            src = iframe.get_attribute('src')
-            id_attr = iframe.get_attribute('id')
-            class_attr = iframe.get_attribute('class')
-            print(f"  Iframe {i}: Src='{src}', ID='{id_attr}', Class='{class_attr}'")
-        
-        # Switch to iframe 11 (the actual ticket modal)
-        if len(iframes) > 11:
-            driver.switch_to.frame(iframes[11])
-            print("Switched to iframe 11 (ticket modal).")
-        else:
-            print("Not enough iframes found. Exiting.")
-            driver.quit()
-            exit()
-        
-        # Wait longer for content to load
-        time.sleep(IFRAME_WAIT)
-        print("Waited 5 seconds for iframe content to load.")
-        
-        # Example: Extract text from any images on the page
+    ticket_iframe = locate_ticket_iframe(driver, EVENTBRITE_URL)
+    
+    if ticket_iframe:
+        driver.switch_to.frame(ticket_iframe)
+        print("Switched to the ticket modal iframe.")
+        
+        # Wait for the iframe content to load
+        wait_for_page_ready(driver, IFRAME_TIMEOUT)
+        load_time = wait_for_settled(driver, IFRAME_TIMEOUT)
+        print(f"Iframe content loaded and settled after {load_time:.2f}s.")
+        page_loads.step("ticket modal")
+        ticket_locators = LearnedLocators(driver, EVENTBRITE_URL)
+        
+        # Example: Extract text from any images on the page (runs in the background during checkout)
         print("\n=== Extracting text from images ===")
-        images = driver.find_elements(By.TAG_NAME, "img")
-        for i, img in enumerate(images):
-            try:
-                src = img.get_attribute('src')
-                if src and src.startswith('data:image'):
-                    # Extract base64 image data
-                    base64_data = src.split(',')[1]
-                    extracted_text = extract_text_from_base64_image(base64_data)
-                    if extracted_text:
-                        print(f"  Image {i}: Extracted text: {extracted_text}")
-            except Exception as e:
-                print(f"  Error processing image {i}: {e}")
+        inline_images = InlineImageExtraction(driver)
         
         # Step 1: Select a ticket quantity (try dropdown or stepper)
         print("\n=== Selecting ticket quantity ===")
@@ -1480,21 +3204,14 @@ try:
                     pass
         if not ticket_quantity_selected:
             print("Could not select ticket quantity. Promo code field may not appear.")
-        time.sleep(2)
+        wait_for_settled(driver)
+        page_loads.step("ticket quantity")
 
         # Step 2: Search for promo code input and apply button
         print("\n=== Searching for promo code input and apply button ===")
-        wait = WebDriverWait(driver, 10)
+        wait = WebDriverWait(driver, STEP_TIMEOUT, poll_frequency=WAIT_POLL_INTERVAL)
         promo_input = None
         apply_button = None
-        # Try to find and click a "Promo code" link/button to reveal the input field
-        try:
-            promo_link = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Promo code') or contains(., 'promo')]")))
-            promo_link.click()
-            print("Clicked 'Promo code' link to reveal input.")
-            time.sleep(2)
-        except Exception as e:
-            print("No 'Promo code' link found, trying to find input directly.")
         # Try various selectors for the promo input
         promo_selectors = [
             "//input[contains(@placeholder, 'promo')]",
@@ -1505,12 +3222,21 @@ try:
             "//input[contains(@class, 'promo')]",
             "//input[@type='text']",
         ]
-        for selector in promo_selectors:
+        # Try to find and click a "Promo code" link/button to reveal the input field
+        try:
+            promo_link = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Promo code') or contains(., 'promo')]")))
+            promo_link.click()
+            print("Clicked 'Promo code' link to reveal input.")
+            wait_for_any_visible(driver, promo_selectors)
+        except Exception as e:
+            print("No 'Promo code' link found, trying to find input directly.")
+        for selector in ticket_locators.ordered('promo_input', promo_selectors):
             try:
                 elements = driver.find_elements(By.XPATH, selector)
                 for element in elements:
                     if element.is_displayed():
                         promo_input = element
+                        ticket_locators.remember('promo_input', selector)
                         print(f"  Found promo input with selector: {selector}")
                         break
                 if promo_input:
@@ -1551,7 +3277,8 @@ try:
         
         # Step 3: Find and click the "Register" button
         print("\n=== Looking for Register button ===")
-        time.sleep(3)  # Wait for any updates after promo code application
+        wait_for_settled(driver)  # Wait for the promo code request and any updates it makes
+        page_loads.step("promo code")
         
         register_button = None
         register_selectors = [
@@ -1572,12 +3299,13 @@ try:
             "//a[contains(., 'register')]",
         ]
         
-        for selector in register_selectors:
+        for selector in ticket_locators.ordered('register_button', register_selectors):
             try:
                 elements = driver.find_elements(By.XPATH, selector)
                 for element in elements:
                     if element.is_displayed() and element.is_enabled():
                         register_button = element
+                        ticket_locators.remember('register_button', selector)
                         print(f"  Found register button with selector: {selector}")
                         break
                 if register_button:
@@ -1601,9 +3329,6 @@ try:
         else:
             print("  Could not find Register button.")
             
-        # Wait to see the result of registration
-        time.sleep(5)
-        
         # Step 4: Select country as United States if dropdown appears
         print("\n=== Looking for country dropdown ===")
         country_selectors = [
@@ -1616,8 +3341,14 @@ try:
             "//select[contains(@class, 'country')]",
         ]
         
+        # Wait for the registration form that Register brings up
+        if not wait_for_any_visible(driver, country_selectors + ["//input[@type='email']"], FORM_LOAD_TIMEOUT):
+            print(f"  Registration form did not appear within {FORM_LOAD_TIMEOUT}s")
+        page_loads.step("registration form")
+        form_locators = LearnedLocators(driver, EVENTBRITE_URL)
+        
         country_selected = False
-        for selector in country_selectors:
+        for selector in form_locators.ordered('country', country_selectors):
             try:
                 elements = driver.find_elements(By.XPATH, selector)
                 for element in elements:
@@ -1628,6 +3359,7 @@ try:
                             select.select_by_visible_text(COUNTRY)
                             print(f"  Selected '{COUNTRY}' from country dropdown.")
                             country_selected = True
+                            form_locators.remember('country', selector)
                             break
                         except Exception as e:
                             print(f"  Could not select United States from dropdown: {e}")
@@ -1640,38 +3372,169 @@ try:
         if not country_selected:
             print("  No country dropdown found or could not select United States.")
         
-        # Step 5: Extract form data from image and fill registration form
+        # Step 5: Extract form data from image (unless a registrant was given) and fill registration form
         print("\n=== Extracting form data and filling registration ===")
         
-        # Extract form data from the specific image
-        image_path = IMAGE_PATH
-        extracted_text = read_image_info(image_path)
-        form_data = extract_form_fields_from_image(image_path)
+        extracted_text = None
+        unfilled = []
+        if form_data is None:
+            # Extract form data from the specific image
+            image_path = IMAGE_PATH
+            extracted_text = read_image_info(image_path)
+            form_data = extract_form_fields_from_image(image_path)
         
         if form_data:
             # Fill the registration form with extracted data
-            fill_registration_form(driver, form_data)
+            unfilled = fill_registration_form(driver, form_data, form_locators)
         else:
             print("  No form data extracted from image.")
         
+        print("\n=== Text extracted from inline images ===")
+        inline_images.collect()
+        
         # Print the raw text extracted from the image
-        print("\n=== RAW TEXT EXTRACTED FROM IMAGE ===")
-        print(extracted_text if extracted_text else "No text extracted.")
+        if extracted_text is not None:
+            print("\n=== RAW TEXT EXTRACTED FROM IMAGE ===")
+            print(extracted_text)
         
     else:
-        print("No iframe found. Exiting.")
-        driver.quit()
-        exit()
+        raise RegistrationError("No ticket modal iframe found.")
+
+    # Wait for the final submissions to finish before closing the browser (only this wait is
+    # timed, the time spent filling in the form isn't page loading)
+    page_loads.start()
+    wait_for_settled(driver)
+    page_loads.step("form settled")
+    page_loads.summary()
+    
+    if not form_data:
+        raise RegistrationError("No form data to fill in.")
+    if unfilled:
+        raise RegistrationError(f"Could not fill {', '.join(unfilled)}")
+    return page_loads.steps
+
+
+def load_registrants(path):
+    """Read a registrant queue: JSONL of batch extraction records or of plain form field dicts
+    
+    Error records and registrants missing a required field are reported and skipped.
+    """
+    registrants = []
+    with open(path) as registrants_file:
+        for line_number, line in enumerate(registrants_file, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'fields' in record:
+                if record.get('error') or not record['fields']:
+                    print(f"  Skipping line {line_number} ({record.get('image')}): {record.get('error') or 'no fields'}")
+                    continue
+                name, form_data = record.get('image'), record['fields']
+            else:
+                name, form_data = None, record
+            name = name or f"{form_data.get('first_name', '')} {form_data.get('last_name', '')}".strip() or f"line {line_number}"
+            missing = missing_registration_fields(form_data)
+            if missing:
+                print(f"  Skipping line {line_number} ({name}): missing {', '.join(missing)}")
+                continue
+            registrants.append((name, form_data))
+    return registrants
+
+def register_with_retries(pool, name, form_data, max_attempts=REGISTRATION_MAX_ATTEMPTS):
+    """Register one person using a session from pool, returning a summary record
+    
+    A failed attempt's session is restarted, so every retry starts in a fresh browser.
+    Only browser and network failures are retried, not a RegistrationDataError.
+    """
+    start_time = time.perf_counter()
+    error = None
+    page_loads = []
+    
+    for attempt in range(1, max_attempts + 1):
+        print(f"\n=== Registering {name} (attempt {attempt}/{max_attempts}) ===")
+        try:
+            with pool.session() as driver:
+                page_loads = register_attendee(driver, dict(form_data))
+            error = None
+            break
+        except RegistrationDataError as e:
+            error = f"{e.__class__.__name__}: {e}"
+            print(f"  Registration of {name} failed, not retrying: {error}")
+            break
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+            print(f"  Registration of {name} failed: {error}")
+        
+        if attempt < max_attempts:
+            time.sleep(random.uniform(0, REGISTRATION_RETRY_DELAY * attempt))
+    
+    return {"registrant": name, "success": error is None, "attempts": attempt, "error": error,
+            "seconds": round(time.perf_counter() - start_time, 2), "page_loads": page_loads}
+
+def run_registrations(registrants_path, max_sessions=REGISTRATION_MAX_SESSIONS, summary_path=REGISTRATION_SUMMARY_PATH):
+    """Register everyone in the queue with up to max_sessions browser sessions at once"""
+    print(f"\n=== Registering everyone in {registrants_path} ===")
+    registrants = load_registrants(registrants_path)
+    print(f"Found {len(registrants)} registrant(s), using {max_sessions} browser session(s)")
+    
+    results = []
+    run_start = time.perf_counter()
+    pool = BrowserSessionPool(max_sessions)
+    try:
+        with ThreadPoolExecutor(max_workers=max_sessions) as executor:
+            futures = [executor.submit(register_with_retries, pool, name, form_data) for name, form_data in registrants]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                status = "✅" if result["success"] else f"❌ {result['error']}"
+                print(f"  [{len(results)}/{len(registrants)}] {result['registrant']} ({result['seconds']:.1f}s, "
+                      f"{result['attempts']} attempt(s)) {status}")
+    finally:
+        pool.close()
+    wall_time = time.perf_counter() - run_start
+    
+    successes = sum(1 for result in results if result["success"])
+    summary = {"registrants": len(results), "successes": successes, "failures": len(results) - successes,
+               "wall_time": round(wall_time, 2), "results": results}
+    with open(summary_path, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    
+    print("\n=== Registration summary ===")
+    for result in sorted(results, key=lambda result: result["registrant"]):
+        status = "✅" if result["success"] else f"❌ {result['error']}"
+        print(f"  {result['registrant']}: {result['seconds']:.1f}s, {result['attempts']} attempt(s) {status}")
+    print(f"\n✅ Registered {successes}/{len(results)} in {wall_time:.1f}s wall time")
+    print(f"📄 Summary written to: {summary_path}")
+    print_extraction_cache_stats()
+    write_extraction_metrics()
+    
+    return summary
 
-    # Wait to see the final result
-    time.sleep(FINAL_WAIT)
+# Batch and benchmark modes only extract images and register_many starts its own browsers, so exit here
+if RUN_MODE == "batch":
+    run_batch_extraction(BATCH_IMAGE_INPUT, BATCH_OUTPUT_PATH, BATCH_MAX_WORKERS, BATCH_FORMS_PER_REQUEST)
+    exit()
+elif RUN_MODE == "benchmark":
+    run_benchmark(BENCHMARK_INPUT, BENCHMARK_OUTPUT_PATH, BATCH_MAX_WORKERS)
+    exit()
+elif RUN_MODE == "register_many":
+    run_registrations(REGISTRANTS_PATH, REGISTRATION_MAX_SESSIONS)
+    exit()
+
+# Set up the driver
+driver = create_driver()
+
+try:
+    reset_session(driver)  # The profile is reused across runs, so drop the last registrant's site storage
+    register_attendee(driver)
+    print_extraction_cache_stats()
+    write_extraction_metrics()
 
 except Exception as e:
     print(f"An error occurred: {e}")
 
 finally:
     driver.quit()
-    time.sleep(FINAL_WAIT)
 
 def process_image_standalone():
     """Standalone function to process image without Eventbrite automation"""
@@ -1,4 +1,6 @@
 import google.generativeai as genai
+import json
+import time
 
 # Put your API key here
 API_KEY = ""
@@ -10,6 +12,12 @@ model = genai.GenerativeModel('gemini-1.5-flash')
 # Image path
 image_path = "/Users/vedant/Downloads/IMG_2162.jpeg"
 
+# Stream the response and print each field as soon as its line is complete
+STREAM_RESPONSE = True
+
+# Every call is appended here, in the same format AgeWellEventbriteLogin.py uses
+METRICS_SAMPLES_PATH = "gemini_metrics_samples.jsonl"
+
 # Read image
 with open(image_path, 'rb') as image_file:
     image_data = image_file.read()
@@ -32,8 +40,60 @@ Liability Agreement: [Yes/No]
 If any field is not found, use 'None' as the value.
 """
 
-response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_data}])
+def stream_fields(response, on_field=None):
+    """Yield (field, value) from a streamed response as each line completes"""
+    pending = ""
+    for chunk in response:
+        pending += chunk.text
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if ':' in line:
+                field, value = line.split(':', 1)
+                if on_field:
+                    on_field(field.strip(), value.strip())
+                yield field.strip(), value.strip()
+    # The last line has no trailing newline
+    if ':' in pending:
+        field, value = pending.split(':', 1)
+        if on_field:
+            on_field(field.strip(), value.strip())
+        yield field.strip(), value.strip()
+
+start_time = time.perf_counter()
+first_field_time = None
+if STREAM_RESPONSE:
+    response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_data}], stream=True)
+    for field, value in stream_fields(response):
+        if first_field_time is None:
+            first_field_time = time.perf_counter() - start_time
+        print(f"{field}: {value}")
+else:
+    response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_data}])
+wall_time = time.perf_counter() - start_time
 result = response.text
 
-# Print results
-print(result) 
\ No newline at end of file
+# Record telemetry for this call
+usage = response.usage_metadata
+sample = {
+    "source": "simple_gemini",
+    "wall_time": wall_time,
+    "model_time": wall_time,
+    "request_bytes": len(prompt.encode('utf-8')) + len(image_data),
+    "prompt_tokens": usage.prompt_token_count,
+    "response_tokens": usage.candidates_token_count,
+    "retries": 0,
+    "first_field_time": first_field_time,
+    "cache": "disabled",
+    "error": None,
+    "timestamp": time.time(),
+}
+with open(METRICS_SAMPLES_PATH, 'a') as samples_file:
+    samples_file.write(json.dumps(sample) + "\n")
+
+# Print results (already printed field by field when streaming)
+if not STREAM_RESPONSE:
+    print(result)
+if first_field_time is not None:
+    print(f"\nTime to first field: {first_field_time:.2f}s")
+print(f"\nLatency: {wall_time:.2f}s, request: {sample['request_bytes']:,} bytes, "
+      f"tokens: {sample['prompt_tokens']} prompt / {sample['response_tokens']} response") 
\ No newline at end of file